@@ -0,0 +1,17 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+# the database driver is synchronous, so the asyncio front end (dbnav.asgi) runs everything that may query the
+# database on this thread pool. the event loop stays free meanwhile, and only waiting sessions hold a thread.
+executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="dbnav-db")
+
+
+# runs func(*args, **kwargs) on the thread pool. the context is copied, so that e.g. the query memo of the
+# render the call belongs to is used in the thread as well.
+async def run(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(executor, functools.partial(context.run, func, *args, **kwargs))
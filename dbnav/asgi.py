@@ -0,0 +1,140 @@
+import asyncio
+import re
+import urllib.parse
+from dbnav import aio
+from dbnav.assets import load_static_files
+from dbnav.control import Control
+from dbnav.serialization import dumps, iterdumps_chunks, loads
+from dbnav.session import copy_state, sessions_from_environ
+
+
+# ASGI counterpart of app.wsgi, e.g. for "uvicorn dbnav.asgi:application". the actions and the database queries of
+# a render are run on the thread pool of dbnav.aio, so a session that waits for the database doesn't occupy a worker,
+# and one process can keep many sessions open.
+
+_index, _css, _scripts = load_static_files()
+sessions = sessions_from_environ()
+
+# the requests of a session are serialized as in app.wsgi, but without blocking the event loop
+_session_locks = [asyncio.Lock() for i in range(64)]
+
+
+async def ajax(cmd, args, session=None):
+    async with _session_locks[hash(session or "") % len(_session_locks)]:
+        state = await aio.run(sessions.get, session) if session else None
+        if state is None:
+            session = sessions.new_id()
+            state = {}
+            # the session is unknown or has expired, so there is no state the command could refer to
+            if not cmd.startswith("insert_"):
+                cmd, args = "insert_index_view", {}
+
+        # the stored state is only replaced if the action and the render succeed
+        ctrl = Control(copy_state(state))
+        await aio.run(getattr(ctrl, cmd), **args)
+        views = await ctrl.arender()
+        await aio.run(sessions.put, session, ctrl.state)
+    return dumps({"session": session, "views": views}, compact=True).encode("utf-8")
+
+
+# the export data of the session's table, and its file name, or None if the session has no table
+async def export(session):
+    async with _session_locks[hash(session) % len(_session_locks)]:
+        state = await aio.run(sessions.get, session)
+        if state is None or state["main"] != "navigate":
+            return None
+        content = await aio.run(Control(state).table_export_data)
+    return content, "{0}.json".format(state["pcf_name"])
+
+
+# (pattern, handler, slash) as the URLs of app.wsgi; handlers get the named groups of the pattern
+urls = [
+    (re.compile(r'^$'), lambda: _index, True),
+    (re.compile(r'^css/(?P<path>.+)$'), lambda path: _css.get(path), False),
+    (re.compile(r'^scripts/(?P<path>.+)$'), lambda path: _scripts.get(path), False),
+    (re.compile(r'^ajax$'), None, True),
+    (re.compile(r'^export$'), export, True),
+]
+
+
+async def application(scope, receive, send):
+
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    path = scope["path"]
+    trailing_slash = path.endswith("/")
+    path = path.lstrip("/").rstrip("/")
+
+    for regex, handler, slash in urls:
+        match = regex.search(path)
+        if match is not None:
+            break
+    else:
+        return await _respond(send, "404 NOT FOUND", [("Content-type", "text/plain")], b"Not Found")
+
+    if slash and not trailing_slash:
+        return await _respond(send, "301 Moved Permanently", [("Location", "/"+path+"/")], b"1")
+
+    if handler is None:  # ajax
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+        try:
+            args = loads(body)
+        except ValueError:  # not JSON, or an object of a class which can't be decoded
+            return await _respond(send, "400 BAD REQUEST", [("Content-type", "text/plain")], b"Bad Request")
+        args.update(match.groupdict())
+        content = await ajax(**args)
+        return await _respond(send, "200 OK", [("Content-type", "application/json"),
+                                               ("Content-Length", str(len(content)))], content)
+
+    if handler is export:
+        get = urllib.parse.parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        if "session" not in get:
+            return await _respond(send, "400 BAD REQUEST", [("Content-type", "text/plain")], b"Bad Request")
+        result = await export(get["session"][0])
+        if result is None:
+            return await _respond(send, "404 NOT FOUND", [("Content-type", "text/plain")], b"Not Found")
+        content, filename = result
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/json"),
+                        (b"content-disposition", 'attachment; filename="{0}"'.format(filename).encode("latin-1"))],
+        })
+        # the rows are fetched while the chunks are encoded, so the chunks are taken on the thread pool
+        chunks = iterdumps_chunks(content)
+        chunk = await aio.run(next, chunks, None)
+        while chunk is not None:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            chunk = await aio.run(next, chunks, None)
+        return await send({"type": "http.response.body", "body": b""})
+
+    asset = handler(**match.groupdict())
+    if asset is None:
+        return await _respond(send, "404 NOT FOUND", [("Content-type", "text/plain")], b"Not Found")
+
+    # Asset.respond expects the request headers in the form of a WSGI environ
+    environ = {"HTTP_" + name.decode("latin-1").upper().replace("-", "_"): value.decode("latin-1")
+               for name, value in scope["headers"]}
+    status, headers, content = asset.respond(environ)
+    await _respond(send, status, headers, content)
+
+
+async def _respond(send, status, headers, content):
+    await send({
+        "type": "http.response.start",
+        "status": int(status.split(" ", 1)[0]),
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+    })
+    await send({"type": "http.response.body", "body": content})
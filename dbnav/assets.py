@@ -0,0 +1,78 @@
+import email.utils
+import gzip
+import hashlib
+import os
+
+
+# a static file, kept in memory together with its gzip compressed form. the files are served as they were when the
+# server started, so they are validated by their content hash (ETag) and the mtime they had at that point.
+class Asset(object):
+
+    def __init__(self, fname, content_type, max_age):
+        with open(fname, "rb") as fp:
+            self.content = fp.read()
+        self.gzipped = gzip.compress(self.content, 9, mtime=0)
+        self.content_type = content_type
+        self.max_age = max_age
+        self.etag = '"{0}"'.format(hashlib.sha1(self.content).hexdigest())
+        self.mtime = int(os.path.getmtime(fname))
+        self.last_modified = email.utils.formatdate(self.mtime, usegmt=True)
+
+    # returns status, headers and body of the response to a GET request with the given WSGI environ
+    def respond(self, environ):
+
+        use_gzip = "gzip" in environ.get("HTTP_ACCEPT_ENCODING", "") and len(self.gzipped) < len(self.content)
+        # the compressed and the uncompressed file are different representations, so they need different ETags
+        etag = self.etag[:-1] + '-gzip"' if use_gzip else self.etag
+
+        headers = [
+            ("ETag", etag),
+            ("Last-Modified", self.last_modified),
+            ("Cache-Control", "public, max-age={0}".format(self.max_age) if self.max_age else "no-cache"),
+            ("Vary", "Accept-Encoding"),
+        ]
+
+        if self._not_modified(environ, etag):
+            return "304 Not Modified", headers, b""
+
+        body = self.gzipped if use_gzip else self.content
+        headers += [("Content-type", self.content_type), ("Content-Length", str(len(body)))]
+        if use_gzip:
+            headers.append(("Content-Encoding", "gzip"))
+        return "200 OK", headers, body
+
+    def _not_modified(self, environ, etag):
+
+        # If-None-Match takes precedence over If-Modified-Since (RFC 7232, section 6)
+        if_none_match = environ.get("HTTP_IF_NONE_MATCH")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in tags)
+
+        if_modified_since = environ.get("HTTP_IF_MODIFIED_SINCE")
+        if if_modified_since is not None:
+            since = email.utils.parsedate_tz(if_modified_since)
+            return since is not None and self.mtime <= email.utils.mktime_tz(since)
+
+        return False
+
+
+# loads all files in directory, which are then served by their name. files that are added later are not found.
+def load_assets(directory, content_type, max_age=7*24*3600):
+    assets = {}
+    for name in os.listdir(directory):
+        fname = os.path.join(directory, name)
+        if os.path.isfile(fname):
+            assets[name] = Asset(fname, content_type, max_age)
+    return assets
+
+
+# the static files of the front ends (index.html, the style sheets and the scripts), read and compressed once, when
+# the application is loaded. index.html is revalidated on every page load (so that a new version is picked up at
+# once), the scripts and style sheets are cached by the browser.
+def load_static_files():
+    basedir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "resources", "server")
+    index = Asset(os.path.join(basedir, "html", "index.html"), "text/html", max_age=0)
+    css = load_assets(os.path.join(basedir, "css"), "text/css")
+    scripts = load_assets(os.path.join(basedir, "scripts"), "text/javascript")
+    return index, css, scripts
@@ -0,0 +1,174 @@
+import contextvars
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+
+# the results are kept as futures, so that a query which is requested while it is already being run (by another
+# thread of the same render) is waited for instead of being run a second time
+class QueryMemo(object):
+
+    def __init__(self):
+        self.results = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        with self._lock:
+            future = self.results.get(key)
+            if future is not None:
+                self.hits += 1
+                return_existing = True
+            else:
+                self.misses += 1
+                future = self.results[key] = Future()
+                return_existing = False
+        if return_existing:
+            return future.result()
+
+        try:
+            result = compute()
+        except BaseException as e:
+            # waiting threads get the exception, but a later request runs the query again
+            with self._lock:
+                del self.results[key]
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+
+_memo = contextvars.ContextVar("dbnav_query_memo", default=None)
+
+
+# within the with-block, queries that are executed through memoized() are run at most once per key
+@contextmanager
+def memoize():
+    memo = QueryMemo()
+    token = _memo.set(memo)
+    try:
+        yield memo
+    finally:
+        _memo.reset(token)
+
+
+def memoized(key, compute):
+    memo = _memo.get()
+    if memo is None:
+        return compute()
+    return memo.get(key, compute)
+
+
+# estimates the memory footprint of a (header, rows) query result
+def result_size(result):
+    header, rows = result
+    size = sys.getsizeof(header) + sum(sys.getsizeof(h) for h in header) + sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+    return size
+
+
+class LRUCache(object):
+
+    def __init__(self, max_entries=256, max_bytes=64*1024*1024, ttl=300.0, sizeof=result_size):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+
+        self._entries = OrderedDict()  # key -> (value, size, expiry time), least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, size, expires = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic() + self.ttl)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, match):
+        with self._lock:
+            for key in [key for key in self._entries if match(key)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    # must be called with self._lock held
+    def _remove(self, key):
+        value, size, expires = self._entries.pop(key)
+        self._bytes -= size
+
+
+# the (header, rows) results of the queries of DBContextFamily._cached_query: result tables, result counts,
+# refinement counts and the group counts of value frequencies and histograms. keyed by (DatabaseInfo.key(), query,
+# tuple(params)).
+result_cache = LRUCache()
+
+# [min, max] scale bounds of DateIntervalFacet, keyed by dbnav.dbcf._bounds_key, i.e. (DatabaseInfo.key(),
+# tuple(mva.sort), mva.sqldef), so that bindings of the same database share them. these don't expire; they are
+# invalidated when the mva is rescaled or deleted, or the binding is written.
+scale_bounds = LRUCache(max_entries=4096, ttl=float("inf"), sizeof=lambda bounds: 0)
+
+# (counts, time.monotonic() of the count, exact) of the objects per sort, shown for the start node of a navigation.
+# keyed by (DatabaseInfo.key(), sorts); see DBContextFamily.sort_counts for when they are refreshed.
+sort_counts = LRUCache(max_entries=256, ttl=3600.0, sizeof=lambda entry: 0)
+
+
+# in-memory snapshots of databases (see dbnav.snapshot), keyed by DatabaseInfo.key(). unlike the caches above, they
+# are only taken and replaced on request, and they are kept when a binding changes.
+snapshots = {}
+
+
+# drops everything that was cached for the database of a binding, e.g. after the binding was changed
+def invalidate_binding(db_key):
+    result_cache.invalidate(lambda key: key[0] == db_key)
+    scale_bounds.invalidate(lambda key: key[0] == db_key)
+    sort_counts.invalidate(lambda key: key[0] == db_key)
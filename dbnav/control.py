@@ -1,8 +1,17 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from dbnav import aio, snapshot
+from dbnav.cache import memoize
 from dbnav.storage import Storage
 from dbnav.graph import Graph, Point
 from dbnav.dbcf import DBContextFamily
 
 
+# number of rows per page of the result table
+page_size = 100
+
 mysql_main_types = ["bool", "date", "int", "varchar"]
 mysql_types = [
     {
@@ -30,6 +39,57 @@ mysql_types = [
 ]
 
 
+# views whose slots are contained in the template of another view; re-rendering the outer view empties them
+_nested_views = {
+    "mainView": ["linksView", "graphView", "tableView", "labelView", "sortsMenu", "sortView", "mvaForm1",
+                 "mvaForm2"],
+    "sortView": ["mvaForm1", "mvaForm2"],
+}
+
+
+# declares the views (by slot) that an action invalidates; only those are recomputed by the following render
+def invalidates(*slots):
+
+    def decorator(action):
+
+        @functools.wraps(action)
+        def wrapper(self, *args, **kwargs):
+            self.invalidate(*slots)
+            return action(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# the data of a view that needs database queries. _render only collects these, and they are computed afterwards
+# by render (or, without blocking the event loop, by arender).
+class Deferred(object):
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def compute(self):
+        return self.func(*self.args)
+
+
+# computes the deferred view data of renders in the synchronous front end
+_render_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="dbnav-render")
+
+
+def _deferred(views):
+    return [value for view in views for value in view["args"].values() if isinstance(value, Deferred)]
+
+
+def _resolve(views, results):
+    for view in views:
+        for key, value in view["args"].items():
+            if isinstance(value, Deferred):
+                view["args"][key] = results[value]
+    return views
+
+
 # class ViewOp(object):
 #
 #     def __init__(self,cmd,args):
@@ -42,73 +102,103 @@ class Control(object):
     def __init__(self, state):
 
         self.state = state
-
+        # slots of the views which have to be rendered; None means all views (nothing has been invalidated
+        # by an action yet, e.g. when rendering a state from scratch)
+        self.invalidated = None
+
+    # the views of one render share a query memo, so that e.g. the extent query issued by the table view
+    # is not run a second time for the sort stats of the label view
+    # the data of the views is computed concurrently, so that a render takes about as long as its slowest query
+    # (each query is run on its own pooled connection)
     def render(self):
+        with memoize():
+            views = self._render()
+            deferred = _deferred(views)
+            if len(deferred) <= 1:
+                return _resolve(views, {d: d.compute() for d in deferred})
+            futures = {d: _render_executor.submit(contextvars.copy_context().run, d.compute) for d in deferred}
+            return _resolve(views, {d: future.result() for d, future in futures.items()})
+
+    # the same as render, for the asyncio front end. _render (which reads bindings from Storage) and the queries
+    # are run on the thread pool of dbnav.aio
+    async def arender(self):
+        with memoize():
+            views = await aio.run(self._render)
+            deferred = _deferred(views)
+            results = await asyncio.gather(*[aio.run(d.compute) for d in deferred])
+            return _resolve(views, dict(zip(deferred, results)))
+
+    def _render(self):
 
         views = []
 
         if self.state["main"] == "index":
 
-            views.append({
-                "cmd": "set_index_view",
-                "args": {
-                    "slot": "mainView",
-                    "template": "script#index_base_template",
-                    "data": self.index_view_data(),
-                }
-            })
+            if self.is_invalid("mainView"):
+                views.append({
+                    "cmd": "set_index_view",
+                    "args": {
+                        "slot": "mainView",
+                        "template": "script#index_base_template",
+                        "data": self.index_view_data(),
+                    }
+                })
 
         elif self.state["main"] == "navigate":
 
-            views.append({
-                "cmd": "set_navigate_view",
-                "args": {
-                    "slot": "mainView",
-                    "template": "script#navigate_base_template",
-                    "data": {},
-                }
-            })
+            if self.is_invalid("mainView"):
+                views.append({
+                    "cmd": "set_navigate_view",
+                    "args": {
+                        "slot": "mainView",
+                        "template": "script#navigate_base_template",
+                        "data": {},
+                    }
+                })
 
-            views.append({
-                "cmd": "set_links_view",
-                "args": {
-                    "slot": "linksView",
-                    "template": "script#links_template",
-                    "data": self.links_view_data(self.state["graph"], self.state["current_node"],
-                                                 self.state["current_link"]),
-                }
-            })
+            if self.is_invalid("linksView"):
+                views.append({
+                    "cmd": "set_links_view",
+                    "args": {
+                        "slot": "linksView",
+                        "template": "script#links_template",
+                        "data": Deferred(self.links_view_data, self.state["graph"], self.state["current_node"],
+                                         self.state["current_link"]),
+                    }
+                })
 
-            views.append({
-                "cmd": "set_graph_view",
-                "args": {
-                    "graph": self.state["graph"],
-                    "current_node": self.state["current_node"],
-                }
-            })
+            if self.is_invalid("graphView"):
+                views.append({
+                    "cmd": "set_graph_view",
+                    "args": {
+                        "graph": self.graph_view_data(self.state["graph"]),
+                        "current_node": self.state["current_node"],
+                    }
+                })
 
-            views.append({
-                "cmd": "set_table_view",
-                "args": {
-                    "slot": "tableView",
-                    "template": "script#result_template",
-                    "data": self.table_view_data(self.state["graph"], self.state["current_node"],
-                                                 self.state["current_link"]["linkID"]),
-                }
-            })
+            if self.is_invalid("tableView"):
+                views.append({
+                    "cmd": "set_table_view",
+                    "args": {
+                        "slot": "tableView",
+                        "template": "script#result_template",
+                        "data": Deferred(self.table_view_data, self.state["graph"], self.state["current_node"],
+                                         self.state["current_link"]["linkID"], self.state.get("table_page", 0)),
+                    }
+                })
 
-            if self.state["current_link"]["linkID"] is None:
+            if self.is_invalid("labelView") and self.state["current_link"]["linkID"] is None:
 
                 views.append({
                     "cmd": "set_sort_label_view",
                     "args": {
                         "slot": "labelView",
                         "template": "script#sort_label_template",
-                        "data": self.state["graph"].stats(self.state["current_node"]),
+                        "data": Deferred(self.state["graph"].stats, self.state["current_node"]),
                     }
                 })
 
-            else:
+            elif self.is_invalid("labelView"):
 
                 rnode_id = self.state["current_link"]["linkID"]
                 rnode = self.state["graph"].rnodes[rnode_id]
@@ -119,53 +209,58 @@ class Control(object):
                     "args": {
                         "slot": "labelView",
                         "template": rcontext.template(),
-                        "data": self.state["graph"].rstats(rnode_id),
+                        "data": Deferred(self.state["graph"].rstats, rnode_id),
                     }
                 })
 
-        elif self.state["main"] == "edit":
+        elif self.state["main"] == "edit" and any(self.is_invalid(slot) for slot in _nested_views["mainView"]):
 
             pcf = Storage.read(self.state["pcf_name"])
 
-            views.append({
-                "cmd": "set_edit_view",
-                "args": {
-                    "slot": "mainView",
-                    "template": "script#edit_base_template",
-                    "data": {},
-                }
-            })
-
-            views.append({
-                "cmd": "set_pcf_sorts_view",
-                "args": {
-                    "slot": "sortsMenu",
-                    "template": "script#pcf_sorts_template",
-                    "data": self.pcf_sorts_view_data(pcf, self.state["current_sort"]),
-                }
-            })
-
-            if self.state["current_sort"] is None:
+            if self.is_invalid("mainView"):
                 views.append({
-                    "cmd": "set_sort_api_view",
+                    "cmd": "set_edit_view",
                     "args": {
-                        "slot": "sortView",
-                        "template": None,
-                        "data": None,
+                        "slot": "mainView",
+                        "template": "script#edit_base_template",
+                        "data": {},
                     }
                 })
 
-            else:
+            if self.is_invalid("sortsMenu"):
                 views.append({
-                    "cmd": "set_sort_api_view",
+                    "cmd": "set_pcf_sorts_view",
                     "args": {
-                        "slot": "sortView",
-                        "template": "script#sort_api_template",
-                        "data": self.pcf_api_view_data(pcf, self.state["current_sort"], self.state["mva_form2"]),
+                        "slot": "sortsMenu",
+                        "template": "script#pcf_sorts_template",
+                        "data": self.pcf_sorts_view_data(pcf, self.state["current_sort"]),
                     }
                 })
 
-                if self.state["mva_form1"] == "derived":
+            if self.state["current_sort"] is None:
+                if self.is_invalid("sortView"):
+                    views.append({
+                        "cmd": "set_sort_api_view",
+                        "args": {
+                            "slot": "sortView",
+                            "template": None,
+                            "data": None,
+                        }
+                    })
+
+            else:
+                if self.is_invalid("sortView"):
+                    views.append({
+                        "cmd": "set_sort_api_view",
+                        "args": {
+                            "slot": "sortView",
+                            "template": "script#sort_api_template",
+                            "data": self.pcf_api_view_data(pcf, self.state["current_sort"],
+                                                           self.state["mva_form2"]),
+                        }
+                    })
+
+                if self.state["mva_form1"] == "derived" and self.is_invalid("mvaForm1"):
                     views.append({
                         "cmd": "set_derived_mva_form",
                         "args": {
@@ -175,7 +270,7 @@ class Control(object):
                         }
                     })
 
-                if self.state["mva_form2"] == "derived":
+                if self.state["mva_form2"] == "derived" and self.is_invalid("mvaForm2"):
                     views.append({
                         "cmd": "set_derived_mva_form",
                         "args": {
@@ -185,7 +280,7 @@ class Control(object):
                         }
                     })
 
-                elif self.state["mva_form2"] == "fk":
+                elif self.state["mva_form2"] == "fk" and self.is_invalid("mvaForm2"):
                     views.append({
                         "cmd": "set_foreign_key_form",
                         "args": {
@@ -197,6 +292,18 @@ class Control(object):
 
         return views
 
+    # marks views (identified by their slot) as invalid, so that the next render recomputes them.
+    # views which are nested in an invalid view are invalid as well.
+    def invalidate(self, *slots):
+        if self.invalidated is None:
+            self.invalidated = set()
+        for slot in slots:
+            self.invalidated.add(slot)
+            self.invalidated.update(_nested_views.get(slot, []))
+
+    def is_invalid(self, slot):
+        return self.invalidated is None or slot in self.invalidated
+
 #  View Updates
 
     def index_view_data(self):
@@ -212,6 +319,9 @@ class Control(object):
         if node.sort is None:
             return {"propertyLinks": [], "relationLinks": []}
 
+        # how many of the current objects each link would keep
+        counts = graph.pcf.refinement_counts(graph, node_id)
+
         for link in graph.pcf.neighbors(node.sort):
             context_id = link["linkID"]
             role_id = link["roleID"]
@@ -219,7 +329,8 @@ class Control(object):
             arity = len(rcontext.sort)
             key = "{0}#{1}".format(role_id, context_id)
             value = {"edgeID": None, "contextID": context_id, "roleID": role_id, "contextName": rcontext.name,
-                     "roleName": rcontext.roles[role_id-1], "exists": False, "selected": False}
+                     "roleName": rcontext.roles[role_id-1], "exists": False, "selected": False,
+                     "count": counts.get(key)}
             if arity == 1:
                 value["displayed"] = context_id in node.display
                 properties[key] = value
@@ -262,19 +373,45 @@ class Control(object):
 
         return {"propertyLinks": property_links, "relationLinks": relation_links}
 
-    def table_view_data(self, graph, node_id, rnode_id):
+    # the graph without its pcf, which holds the database credentials and stays on the server
+    def graph_view_data(self, graph):
+        return {"nodes": graph.nodes, "rnodes": graph.rnodes, "_next_id": graph._next_id,
+                "_next_rid": graph._next_rid}
 
+    def table_view_data(self, graph, node_id, rnode_id, page=0):
+
+        #  only the requested page is fetched; the row count is queried separately
         if rnode_id is None:
-            table = graph.extent(node_id)
+            count = graph.count(node_id)
         else:
-            table = graph.rextent(rnode_id)
+            count = graph.rcount(rnode_id)
+        pages = max(1, (count + page_size - 1) // page_size)
+        page = min(max(int(page), 0), pages - 1)
+
+        if rnode_id is None:
+            table = graph.extent(node_id, page_size, page * page_size)
+        else:
+            table = graph.rextent(rnode_id, page_size, page * page_size)
         #  process header and rows
         header = [{"value": value, "width": 200} for value in table.header]
         rows = [None]*len(table.rows)
         for i, row in enumerate(table.rows):
             rows[i] = [{"value": str(value), "width": 200} for value in row]
 
-        return {"header": header, "rows": rows}
+        # snapshots are only offered if numpy is installed
+        return {"header": header, "rows": rows, "page": page, "pages": pages, "count": count,
+                "snapshots": snapshot.numpy is not None}
+
+    # the complete result table of the current node or link, for download. the rows are fetched while the response
+    # is written (see serialization.iterdumps).
+    def table_export_data(self):
+        graph = self.state["graph"]
+        rnode_id = self.state["current_link"]["linkID"]
+        if rnode_id is None:
+            table = graph.iter_extent(self.state["current_node"])
+        else:
+            table = graph.iter_rextent(rnode_id)
+        return {"header": table.header, "rows": ([str(value) for value in row] for row in table.rows)}
 
     def pcf_sorts_view_data(self, pcf, sort):
         sort_list = [{"name": s, "selected": s == sort} for s in pcf.sorts]
@@ -377,22 +514,28 @@ class Control(object):
 
     #  Actions
 
+    @invalidates("mainView")
     def insert_index_view(self):
         self.state = {"main": "index"}
 
+    @invalidates("mainView")
     def insert_navigate_view(self, pcf_name):
         pcf = Storage.read(pcf_name)
         graph = Graph(pcf)
         x1 = graph.add_node(None, Point(305, 150))
 
         self.state = {"main": "navigate", "pcf_name": pcf_name, "graph": graph, "current_node": x1,
-                      "current_link": {"linkID": None, "roleID": None}}
+                      "current_link": {"linkID": None, "roleID": None}, "table_page": 0}
 
+    @invalidates("mainView")
     def insert_edit_view(self, pcf_name):
         self.state = {"main": "edit", "pcf_name": pcf_name, "current_sort": None, "mva_form1": None,
                       "mva_form2": None, "mva_form1_data": {}, "mva_form2_data": {}}
 
+    # the links view shows refinement counts for the current extent, which the label changes
+    @invalidates("linksView", "graphView", "tableView", "labelView")
     def set_label(self, label):
+        self.state["table_page"] = 0
         if self.state["current_link"]["linkID"] is None:  # object node
             node = self.state["graph"].nodes[self.state["current_node"]]
             node.sort = label
@@ -402,13 +545,18 @@ class Control(object):
             rnode = self.state["graph"].rnodes[self.state["current_link"]["linkID"]]
             rnode.label = label
 
+    @invalidates()
     def set_position(self, node_id, x, y):
         self.state["graph"].set_position(node_id, x, y)
 
+    @invalidates("linksView", "graphView", "tableView", "labelView")
     def merge(self, target_id):
+        self.state["table_page"] = 0
         self.state["graph"].merge(self.state["current_node"], target_id)
 
+    @invalidates("linksView", "graphView", "tableView", "labelView")
     def create_edge(self, context_id, role_id):
+        self.state["table_page"] = 0
         node_id = self.state["current_node"]
         rcontext = self.state["graph"].pcf.rcontexts[context_id]
 
@@ -416,20 +564,31 @@ class Control(object):
         endpoints[role_id-1] = node_id
         self.state["graph"].add_rnode(context_id, endpoints)
 
+    @invalidates("linksView", "tableView", "labelView")
     def select_edge(self, edge_id, role_id):
+        self.state["table_page"] = 0
         if edge_id is None:
             self.state["current_link"] = {"linkID": None, "roleID": None}
         else:
             self.state["current_link"] = {"linkID": edge_id, "roleID": role_id}
 
+    @invalidates("linksView", "graphView", "tableView", "labelView")
     def remove_edge(self, edge_id, role_id):
+        self.state["table_page"] = 0
         self.state["graph"].remove_rnode(edge_id, role_id)
         self.state["current_link"] = {"linkID": None, "roleID": None}
 
+    @invalidates("linksView", "graphView", "tableView", "labelView")
     def select_node(self, node_id):
+        self.state["table_page"] = 0
         self.state["current_node"] = node_id
         self.state["current_link"] = {"linkID": None, "roleID": None}
 
+    @invalidates("tableView")
+    def set_table_page(self, page):
+        self.state["table_page"] = int(page)
+
+    @invalidates("linksView", "tableView")
     def toggle_display(self, context_id):
         node = self.state["graph"].nodes[self.state["current_node"]]
         if context_id in node.display:
@@ -437,12 +596,23 @@ class Control(object):
         else:
             node.display.add(context_id)
 
+    @invalidates("mainView")
     def create_binding(self, form):
 
-        pcf = DBContextFamily(form["user"], form["password"], form["host"], form["database"])
+        pcf = DBContextFamily(form["user"], form["password"], form["host"], form["database"],
+                              form.get("backend", "mysql"))
         pcf.load_contents()
         Storage.write(pcf, form["name"] if form["name"] else form["database"])
 
+    # answers the navigation queries of the current binding from an in-memory snapshot of its database (see
+    # dbnav.snapshot); taking it again re-reads the database. without numpy, the table view doesn't offer it, and
+    # the queries keep going to the database.
+    @invalidates("linksView", "tableView", "labelView")
+    def refresh_snapshot(self):
+        if snapshot.numpy is not None:
+            snapshot.refresh(self.state["graph"].pcf)
+
+    @invalidates("sortsMenu", "sortView")
     def select_sort(self, sort):
         self.state["current_sort"] = sort
         self.state["mva_form1"] = "derived"
@@ -466,6 +636,7 @@ class Control(object):
             "nargs": "2",
         }
 
+    @invalidates("sortView")
     def select_mva_form2(self, form_id):
         if form_id == "derived":
             self.state["mva_form2"] = "derived"
@@ -492,11 +663,13 @@ class Control(object):
                 "role2": "ARG2",
             }
 
+    @invalidates("mvaForm1")
     def update_form1(self, form_data):
         self.state["mva_form1_data"] = form_data
         if self.state["mva_form1"] == "derived":
             assert(int(self.state["mva_form1_data"]["nargs"]) == 1)
 
+    @invalidates("mvaForm2")
     def update_form2(self, form_data):
         self.state["mva_form2_data"] = form_data
         #  TODO: the code below (handling nargs change) probably works, but doesn't look good
@@ -526,6 +699,7 @@ class Control(object):
                     self.state["mva_form2_data"]["sort{0}".format(nargs)] = self.state["current_sort"]
                     self.state["mva_form2_data"]["role{0}".format(nargs)] = "ARG{0}".format(nargs)
 
+    @invalidates("sortView")
     def create_mva1(self, form_data):
         pcf = Storage.read(self.state["pcf_name"])
         if self.state["mva_form1"] == "derived":
@@ -545,7 +719,7 @@ class Control(object):
 
             sort = [form_data["sort{0}".format(i+1)] for i in range(int(form_data["nargs"]))]
             roles = [form_data["role{0}".format(i+1)] for i in range(int(form_data["nargs"]))]
-            pcf.add_mva(form_data["name"], sort, form_data["datatype"], form_data["sqldef"], roles)
+            self._edit(pcf, "add_mva", form_data["name"], sort, form_data["datatype"], form_data["sqldef"], roles)
 
             self.state["mva_form1_data"] = {
                 "datatype": None,
@@ -555,8 +729,8 @@ class Control(object):
                 "role1": "ATTR",
                 "nargs": "1",
             }
-        Storage.write(pcf, self.state["pcf_name"])
 
+    @invalidates("sortView")
     def create_mva2(self, form_data):
         pcf = Storage.read(self.state["pcf_name"])
         if self.state["mva_form2"] == "derived":
@@ -581,7 +755,7 @@ class Control(object):
 
             sort = [form_data["sort{0}".format(i+1)] for i in range(int(form_data["nargs"]))]
             roles = [form_data["role{0}".format(i+1)] for i in range(int(form_data["nargs"]))]
-            pcf.add_mva(form_data["name"], sort, form_data["datatype"], form_data["sqldef"], roles)
+            self._edit(pcf, "add_mva", form_data["name"], sort, form_data["datatype"], form_data["sqldef"], roles)
 
             self.state["mva_form2_data"] = {
                 "datatype": None,
@@ -614,8 +788,8 @@ class Control(object):
             roles = [form_data["role1"], form_data["role2"]]
             colname1 = pcf.mvas[form_data["column1"]].name
             colname2 = pcf.mvas[form_data["column2"]].name
-            mva_id = pcf.add_foreign_key(form_data["name"], form_data["sort1"], colname1, form_data["sort2"], colname2)
-            pcf.mvas[mva_id].roles = roles
+            self._edit(pcf, "add_foreign_key", form_data["name"], form_data["sort1"], colname1, form_data["sort2"],
+                       colname2, roles)
 
             self.state["mva_form2_data"] = {
                 "name": "",
@@ -626,19 +800,25 @@ class Control(object):
                 "column2": None,
                 "role2": "ARG2",
             }
-        Storage.write(pcf, self.state["pcf_name"])
 
+    @invalidates("sortView")
     def scale_mva(self, mva_id, context_class):
         pcf = Storage.read(self.state["pcf_name"])
-        pcf.scale_mva(mva_id, context_class)
-        Storage.write(pcf, self.state["pcf_name"])
+        self._edit(pcf, "scale_mva", mva_id, context_class)
 
+    @invalidates("sortView")
     def delete_mva(self, mva_id):
         pcf = Storage.read(self.state["pcf_name"])
-        pcf.delete_mva(mva_id)
-        Storage.write(pcf, self.state["pcf_name"])
+        self._edit(pcf, "delete_mva", mva_id)
 
+    @invalidates("sortView")
     def set_output_sql(self, sqlterm):
         pcf = Storage.read(self.state["pcf_name"])
-        pcf.set_printsql(self.state["current_sort"], sqlterm)
-        Storage.write(pcf, self.state["pcf_name"])
+        self._edit(pcf, "set_printsql", self.state["current_sort"], sqlterm)
+
+    # applies an edit to pcf (which must have been read from the current binding), and records it in the binding's
+    # journal. applying it first checks that it is valid, e.g. that the mva it refers to exists.
+    def _edit(self, pcf, op, *args):
+        result = pcf.apply(op, list(args))
+        Storage.append(self.state["pcf_name"], op, list(args))
+        return result
@@ -1,13 +1,72 @@
-from collections import Counter
-from dbnav.table import Table
+from dbnav.cache import memoized, result_cache, scale_bounds, snapshots, sort_counts
+from dbnav.dialects import dialects
+from dbnav.pool import get_pool
+from dbnav.table import LazyTable, Table
+from contextlib import ExitStack
+import copy
 import json
-import mysql.connector
+import threading
+import time
 
 
 class SupremumUndefinedError(Exception):
     pass
 
 
+# runs a query on a pooled connection and returns (header, rows). within Control.render, identical queries
+# (e.g. the extent query for the table view and for the sort stats) share a single execution. if params is given,
+# the query is a template with %s placeholders, and it is run as a prepared statement (see Dialect.execute).
+def _query(db_info, query, params=None):
+
+    def fetch():
+        with db_info.connection() as cnx:
+            cursor = db_info.dialect.execute(cnx, query, params)
+            rows = cursor.fetchall()
+            header = [t[0] for t in cursor.description]
+            if params is None:
+                cursor.close()
+        return header, rows
+
+    return memoized((query, None if params is None else tuple(params)), fetch)
+
+
+# escapes the wildcards of a LIKE pattern, for the escape character "!" (which, unlike "\\", means the same in
+# all SQL dialects)
+def _escape_like(text):
+    return text.replace("!", "!!").replace("%", "!%").replace("_", "!_")
+
+
+# the key of the scale bounds of a DateIntervalFacet on mva
+def _bounds_key(db_info, mva):
+    return db_info.key(), tuple(mva.sort), mva.sqldef
+
+
+# the connected components of the subgraph induced by node_ids, each as a list of node ids in breadth-first order
+def _components(graph, node_ids):
+
+    members = set(node_ids)
+    adjacent = {node_id: [] for node_id in node_ids}
+    for rnode in graph.rnodes.values():
+        endpoints = [x for x in rnode.endpoints if x in members]
+        for x in endpoints:
+            adjacent[x] += endpoints
+
+    components = []
+    visited = set()
+    for start in node_ids:
+        if start in visited:
+            continue
+        visited.add(start)
+        component = [start]
+        for x in component:  # component grows while it is traversed
+            for y in adjacent[x]:
+                if y not in visited:
+                    visited.add(y)
+                    component.append(y)
+        components.append(component)
+    return components
+
+
 class ManyValuedAttribute(object):
 
     def __init__(self, name, sort, datatype, sqldef, roles=None):
@@ -44,25 +103,26 @@ class ManyValuedAttribute(object):
         return mva
 
 
+# the sqldefs of columns and foreign keys are written in the dialect of the database they were loaded from, and
+# are kept as they are when a binding is decoded
 class DBColumn(ManyValuedAttribute):
 
-    def __init__(self, name, sort, datatype):
-        sqldef = "{{0}}.{0}".format(name)
-        super().__init__(name, sort, datatype, sqldef)
+    def __init__(self, name, sort, datatype, dialect=dialects["mysql"]):
+        super().__init__(name, sort, datatype, dialect.column(name))
 
     @classmethod
     def from_dict(cls, obj):
         mva = cls(obj["name"], obj["sort"], obj["datatype"])
+        mva.sqldef = obj["sqldef"]
         mva.roles = obj["roles"]
         return mva
 
 
 class ForeignKey(ManyValuedAttribute):
 
-    def __init__(self, name, sort, columns):
+    def __init__(self, name, sort, columns, dialect=dialects["mysql"]):
         self.columns = columns
-        sqldef = "IF({{0}}.{0}={{1}}.{1},1,0)".format(*columns)
-        super().__init__(name, sort, "bool", sqldef)
+        super().__init__(name, sort, "bool", dialect.foreign_key(*columns))
 
     def to_dict(self):
         obj = super().to_dict()
@@ -72,6 +132,7 @@ class ForeignKey(ManyValuedAttribute):
     @classmethod
     def from_dict(cls, obj):
         mva = cls(obj["name"], obj["sort"], obj["columns"])
+        mva.sqldef = obj["sqldef"]
         mva.roles = obj["roles"]
         return mva
 
@@ -104,10 +165,11 @@ class ScaledContext(object):
     def mva_sql(self, args):
         return self.mva.sql(args)
 
+    # returns a condition on the objects args, as an sql template with %s placeholders and its parameters
     def pattern_sql(self, label, args):
         raise NotImplementedError
 
-    def stats(self, table, label):
+    def stats(self, graph, rnode_id):
         raise NotImplementedError
 
     def top(self):
@@ -143,9 +205,9 @@ class BooleanFacet(ScaledContext):
 
         assert str(label) == "1"  # boolean scale only allows label to be "1"
         sqlterm = self.mva_sql(args)
-        return "{0}=1".format(sqlterm)
+        return "{0}=1".format(sqlterm), []
 
-    def stats(self, table, label):
+    def stats(self, graph, rnode_id):
         return {}
 
     def top(self):
@@ -157,6 +219,11 @@ class BooleanFacet(ScaledContext):
 
 class PrefixFacet(ScaledContext):
 
+    # at most this many values (the most frequent ones) are listed in the label view
+    max_values = 500
+    # if set, values are counted by their first len(label)+1 characters, i.e. by the next character to be typed
+    bucket_prefixes = False
+
     def cmd(self):
         return "set_prefix_label_view"
 
@@ -168,15 +235,15 @@ class PrefixFacet(ScaledContext):
         assert isinstance(label, str)  # the label is supposed to be a string
         sqlterm = self.mva_sql(args)
         if not label:  # empty string
-            return "{0} IS NOT NULL".format(sqlterm)
-        return "{0} LIKE '{1}%'".format(sqlterm, label)
+            return "{0} IS NOT NULL".format(sqlterm), []
+        return "{0} LIKE %s ESCAPE '!'".format(sqlterm), [_escape_like(label) + "%"]
 
-    def stats(self, table, label):
-        # TODO relying on column [len(self.sort)] to contain the mva-values seems too error-prone
-        values = [row[len(self.sort)] for row in table.rows]
-        freq = [(k, v) for k, v in Counter(values).items()]
+    def stats(self, graph, rnode_id):
+        label = graph.rnodes[rnode_id].label
+        prefix_length = len(label) + 1 if self.bucket_prefixes else None
+        freq = graph.pcf.value_frequencies(graph, rnode_id, prefix_length, self.max_values)
         freq.sort(key=lambda x: x[0])
-        return {"freq": freq, "count": len(values), "label": label}
+        return {"freq": freq, "count": graph.rcount(rnode_id), "label": label}
 
     def top(self):
         return ""
@@ -196,87 +263,121 @@ class DateIntervalFacet(ScaledContext):
     def pattern_sql(self, label, args):
         sqlterm = self.mva_sql(args)
         label_min, label_max = json.loads(label)
-        return "{0} BETWEEN '{1}-01-01' AND '{2}-12-31'".format(sqlterm, label_min, label_max)
-
-    def stats(self, table, label):
-        # TODO relying on column [len(self.sort)] to contain the mva-values seems too error-prone
-        values = [row[len(self.sort)] for row in table.rows]
-
-        # histogram = [0] * self.nbins
-        # data_min = None
-        # data_max = None
-
-        # if values:
-        #     data_min = values[0].year
-        #     data_max = values[0].year
-        #     for d in values:
-        #         v = d.year
-        #         assert(self.mindate <= v <= self.maxdate)
-        #         histogram[int((v-self.mindate) // self.step)] += 1
-        #         data_min = min(data_min, v)
-        #         data_max = max(data_max, v)
+        return "{0} BETWEEN %s AND %s".format(sqlterm), ["{0}-01-01".format(int(label_min)),
+                                                         "{0}-12-31".format(int(label_max))]
+
+    def stats(self, graph, rnode_id):
+        label = graph.rnodes[rnode_id].label
+        histogram = graph.pcf.value_histogram(graph, rnode_id)
 
         label_min, label_max = json.loads(label)
-        # TODO cache boundary interval on the object, or store on rnode, to avoid unnecessary self.top() queries?
         scale_min, scale_max = json.loads(self.top())
 
-        return {"count": len(values), "scale_min": scale_min, "scale_max": scale_max,
-                "label_min": label_min, "label_max": label_max}
-
+        # the histogram has a bin for every year of the scale (and of values added since the bounds were cached),
+        # so that its bars line up with the slider; years without values are counted as 0. the bars are scaled to
+        # the largest bin.
+        counts = {int(year): count for year, count in histogram if year is not None}
+        first = min([scale_min] + list(counts))
+        last = max([scale_max] + list(counts))
+        bins = [(year, counts.get(year, 0)) for year in range(first, last + 1)]
+        return {"count": sum(count for year, count in histogram), "histogram": bins,
+                "max_bin": max([count for year, count in bins], default=0),
+                "scale_min": scale_min, "scale_max": scale_max, "label_min": label_min, "label_max": label_max}
+
+    # the scale bounds are the years of the smallest and largest value of the mva. they are cached per
+    # database and definition of the mva (not per binding, where mva ids are assigned), and only recomputed
+    # after scale_bounds has been invalidated for the mva.
     def top(self):
+        key = _bounds_key(self.db_info, self.mva)
+        bounds = scale_bounds.get(key)
+        if bounds is None:
+            bounds = self._bounds()
+            scale_bounds.put(key, bounds)
+        return json.dumps(bounds)
+
+    def _bounds(self):
         args = ["x{0}".format(i+1) for i in range(len(self.sort))]
         sql_term = self.mva_sql(args)
         from_clause = ", ".join(["{0} AS {1}".format(s,x) for s,x in zip(self.sort, args)])
-        query = "SELECT MIN({0}) AS mindate, MAX({0}) AS maxdate FROM {1}".format(sql_term, from_clause)
-
-        cnx = mysql.connector.connect(user=self.db_info.user, password=self.db_info.password,
-                                      host=self.db_info.host, database=self.db_info.database)
-        cursor = cnx.cursor()
-        cursor.execute(query)
-        row = cursor.fetchone()
-        header = [t[0] for t in cursor.description]
+        # the years are taken by the database, as not all drivers return the dates of an aggregate as dates
+        dialect = self.db_info.dialect
+        query = "SELECT {0} AS mindate, {1} AS maxdate FROM {2}".format(
+            dialect.year("MIN({0})".format(sql_term)), dialect.year("MAX({0})".format(sql_term)), from_clause)
 
-        cursor.close()
-        cnx.close()
+        header, rows = _query(self.db_info, query)
+        row = rows[0]
 
         assert(header[0] == "mindate")
-        mindate = row[0].year
+        mindate = int(row[0])
 
         assert(header[1] == "maxdate")
-        maxdate = row[1].year
+        maxdate = int(row[1])
 
-        return json.dumps([mindate, maxdate])
+        return [mindate, maxdate]
 
     def supremum(self, pattern1, pattern2):
         pass
 
 
+# backend is the name of the dialect (see dialects.dialects). for SQLite, database is the name of the database file.
 class DatabaseInfo(object):
 
-    def __init__(self, user, password, host, database):
+    def __init__(self, user, password, host, database, backend="mysql"):
         self.user = user
         self.password = password
         self.host = host
         self.database = database
+        self.backend = backend
+
+    @property
+    def dialect(self):
+        return dialects[self.backend]
 
+    def connect(self):
+        return self.dialect.connect(self)
+
+    def key(self):
+        return self.user, self.password, self.host, self.database, self.backend
+
+    def connection(self):
+        pool = get_pool(self.key(), self.connect, check=self.dialect.is_connected,
+                        name="{0}@{1}/{2}".format(self.user, self.host, self.database))
+        return pool.connection()
+
+    # the backend is left out for MySQL, so that bindings which were written before there were other backends
+    # are encoded as they were
     def to_dict(self):
-        return {
+        obj = {
             "user": self.user,
             "password": self.password,
             "host": self.host,
             "database": self.database,
         }
+        if self.backend != "mysql":
+            obj["backend"] = self.backend
+        return obj
 
     @classmethod
     def from_dict(cls, obj):
-        return DatabaseInfo(obj["user"], obj["password"], obj["host"], obj["database"])
+        return DatabaseInfo(obj["user"], obj["password"], obj["host"], obj["database"], obj.get("backend", "mysql"))
+
+
+# exact sort counts which are older than this are recounted in the background (they are still shown meanwhile)
+sort_counts_refresh = 300.0
+
+_refreshing = set()  # keys of sort_counts which are being recounted
+_refreshing_lock = threading.Lock()
 
 
 class DBContextFamily(object):
 
-    def __init__(self, user, password, host, database):
+    # if set, sort counts which are not cached are first taken from the table statistics of the database (which
+    # are only estimates for InnoDB), while the exact counts are computed in the background
+    estimate_sort_counts = False
+
+    def __init__(self, user, password, host, database, backend="mysql"):
         self.output = {}
-        self.db_info = DatabaseInfo(user, password, host, database)
+        self.db_info = DatabaseInfo(user, password, host, database, backend)
         self.rcontexts = {}
         self.mvas = {}
         self._next_id = 1
@@ -285,6 +386,12 @@ class DBContextFamily(object):
     def sorts(self):
         return sorted(self.output.keys())
 
+    # a copy which shares nothing with the original, so that neither the methods that change a family (add_*,
+    # delete_mva, scale_mva, set_printsql) nor changes to its mvas and contexts affect the original. the mvas and
+    # contexts are small, so this takes a few milliseconds even for large bindings.
+    def copy(self):
+        return copy.deepcopy(self)
+
     # There is possible confusion regarding the sort order: we represent sorts by patterns, and pattern1 <= pattern2
     # means that pattern1 represents a supersort (not subsort!!) of pattern2. The rationale is that sorts can be
     # understood as pattern concepts (obtained from the pcf's object context), and then the order on pattern intents
@@ -314,13 +421,15 @@ class DBContextFamily(object):
     def add_column(self, name, sort, datatype):
         mva_id = "m" + str(self._next_id)
         self._next_id += 1
-        self.mvas[mva_id] = DBColumn(name, [sort], datatype)
+        self.mvas[mva_id] = DBColumn(name, [sort], datatype, self.db_info.dialect)
         return mva_id
 
-    def add_foreign_key(self, name, sort1, column1, sort2, column2):
+    def add_foreign_key(self, name, sort1, column1, sort2, column2, roles=None):
         mva_id = "m" + str(self._next_id)
         self._next_id += 1
-        self.mvas[mva_id] = ForeignKey(name, [sort1, sort2], [column1, column2])
+        self.mvas[mva_id] = ForeignKey(name, [sort1, sort2], [column1, column2], self.db_info.dialect)
+        if roles is not None:
+            self.mvas[mva_id].roles = roles
         return mva_id
 
     def add_mva(self, name, sort, datatype, sqldef, roles):
@@ -330,6 +439,9 @@ class DBContextFamily(object):
         return mva_id
 
     def delete_mva(self, name):
+        if name in self.mvas:
+            bounds_key = _bounds_key(self.db_info, self.mvas[name])
+            scale_bounds.invalidate(lambda key: key == bounds_key)
         self.mvas = {mva_id: mva for mva_id, mva in self.mvas.items() if mva_id != name}
         # TODO if the deleted mva is used by an rcontext, the rcontext is also deleted (should it be
         #  be forbidden to delete mva's while used by a context instead ?)
@@ -340,6 +452,8 @@ class DBContextFamily(object):
 
     def scale_mva(self, mva_id, scaled_context_class):
 
+        bounds_key = _bounds_key(self.db_info, self.mvas[mva_id])
+        scale_bounds.invalidate(lambda key: key == bounds_key)
         if scaled_context_class is None or scaled_context_class == "":
             self.rcontexts.pop(mva_id, None)
         else:
@@ -352,6 +466,15 @@ class DBContextFamily(object):
 
             self.rcontexts[mva_id] = scaled_context
 
+    # the operations by which a binding is edited. Storage records them in the binding's journal, and replays them
+    # with apply. mva ids are assigned on replay, so the order of the journal determines them.
+    journaled_ops = ("add_mva", "add_foreign_key", "scale_mva", "delete_mva", "set_printsql")
+
+    def apply(self, op, args):
+        if op not in self.journaled_ops:
+            raise ValueError("Unknown operation {0}".format(op))
+        return getattr(self, op)(*args)
+
     def print_sql(self, sort, node_id):
         return self.output[sort].format(node_id)
 
@@ -367,13 +490,16 @@ class DBContextFamily(object):
     def count_by_sort(self, objects):
         pass
 
-    def _to_sql(self, graph, window, rwindow=None):
+    # returns the query as an sql template with %s placeholders and its parameters, which are taken from the rnode
+    # labels. if limit is given, rows are ordered by all columns, so that consecutive pages don't overlap. (keyset
+    # pagination is not an option, because the columns are arbitrary sql terms which may evaluate to NULL.)
+    # with count=True, the query only counts the rows (which are distinct, see below) instead of returning them.
+    # if columns are given, they are selected instead of the window (e.g. aggregates, see refinement_counts).
+    def _to_sql(self, graph, window, rwindow=None, limit=None, offset=0, count=False, columns=None):
 
         rwindow = rwindow or []
 
         select = []
-        from_ = []
-        where = []
 
         # select clause
         for node_id in window:
@@ -396,140 +522,352 @@ class DBContextFamily(object):
                 select.append("{0} AS 'display:{1}:{2}:{3}'".format(rcontext.mva_sql([window[0]]), len(window[0]),
                                                                  window[0], context_id))
 
-        # from clause
-        for node_id, node in graph.nodes.items():
-            from_.append("{0} AS {1}".format(node.sort, node_id))
-
-        # where clause
-        for rnode in graph.rnodes.values():
-            rcontext = self.rcontexts[rnode.context_id]
-            condition = rcontext.pattern_sql(rnode.label, rnode.endpoints)
-            where.append(condition)
-
-        query = ("SELECT DISTINCT " + ", ".join(select) + " FROM " + ", ".join(from_)
-                 + (" WHERE " if where else "") + " AND ".join(where))
-
-        return query
-
-    def result_table(self, graph, window, rwindow):
-
-        # check if the graph is trivial (isolated node).
-        # theory-wise, returning an empty table is wrong; but it's convenient
-        if len(graph.nodes) == 1 and len(graph.rnodes) == 0 and next(iter(graph.nodes.values())).sort is None:
-            return Table([], [])
-
-        query = self._to_sql(graph, window, rwindow)
+        # from and where clauses: only the window nodes are joined (along the rnodes between them). the other nodes
+        # fall into pieces, the components of the graph without the window, and each piece is a correlated EXISTS
+        # subquery which contains the rnodes connecting it to the window. pieces that aren't connected to the window
+        # at all just have to be non-empty. each row of the join is a different combination of objects, so unlike
+        # a join of the whole graph, the result needs no DISTINCT. (a node may occur twice in the window, as the
+        # endpoints of a self-loop, but it is only joined once.)
+        in_window = list(dict.fromkeys(window))
+        for rnode_id in rwindow:
+            in_window += [x for x in graph.rnodes[rnode_id].endpoints if x not in in_window]
+        from_, params, where, where_params = self._join(graph, in_window)
 
-        #  query the database
-        cnx = mysql.connector.connect(user=self.db_info.user, password=self.db_info.password,
-                                      host=self.db_info.host, database=self.db_info.database)
-        cursor = cnx.cursor()
+        for piece in _components(graph, [x for x in graph.nodes if x not in in_window]):
+            sub_from, sub_params, sub_where, sub_where_params = self._join(graph, piece, outer=in_window)
+            where.append("EXISTS (SELECT 1 FROM " + sub_from + (" WHERE " if sub_where else "")
+                         + " AND ".join(sub_where) + ")")
+            where_params += sub_params + sub_where_params
 
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        header = [t[0] for t in cursor.description]
+        if count:
+            select = ["COUNT(*)"]
+        elif columns is not None:
+            select = columns
 
-        cursor.close()
-        cnx.close()
+        query = ("SELECT " + ", ".join(select) + " FROM " + from_
+                 + (" WHERE " if where else "") + " AND ".join(where))
+        params += where_params
 
-        def rename(colname):
+        if limit is not None and not count and columns is None:
+            query += " ORDER BY {0} LIMIT {1} OFFSET {2}".format(", ".join(str(i+1) for i in range(len(select))),
+                                                                 int(limit), int(offset))
 
-            type_, key = colname.split(":",1)
-            assert(type_ in ["node", "rnode", "display"])
+        return query, params
 
-            if type_ == "node":
-                node = graph.nodes[key]
-                return "{0}:{1}".format(node.sort, key)
+    # the from clause which joins the given nodes (in this order) along the rnodes between them, and the conditions
+    # which can't be put into an ON clause because they only concern the first node, each with their parameters.
+    # rnodes which connect the nodes with outer nodes (of an enclosing query) are included, rnodes between outer
+    # nodes only are not.
+    def _join(self, graph, node_ids, outer=()):
 
-            elif type_ == "rnode":
-                rnode = graph.rnodes[key]
-                mva = self.rcontexts[rnode.context_id].mva
-                return "{0}({1})".format(mva.name, ",".join(rnode.endpoints))
+        joined = set(outer)
+        members = joined.union(node_ids)
+        pending = [rnode for rnode in graph.rnodes.values()
+                   if members.issuperset(rnode.endpoints) and not joined.issuperset(rnode.endpoints)]
 
-            # TODO: maybe refactor to get rid of complicated encoding scheme (see remark in _to_sql function)
-            elif type_ == "display":
-                length1, keys = key.split(":",1)
-                length1 = int(length1)
-                assert keys[length1] == ":"
-                node_id = keys[:length1]
-                context_id = keys[length1+1:]
-                mva = self.rcontexts[context_id].mva
-                return "{0}.{1}".format(node_id, mva.name)
+        from_ = []
+        from_params = []
+        where = []
+        where_params = []
+        for node_id in node_ids:
+            joined.add(node_id)
+            conditions = []
+            params = []
+            for rnode in pending:
+                if joined.issuperset(rnode.endpoints):
+                    condition, condition_params = self.rcontexts[rnode.context_id].pattern_sql(rnode.label,
+                                                                                               rnode.endpoints)
+                    conditions.append(condition)
+                    params += condition_params
+            pending = [rnode for rnode in pending if not joined.issuperset(rnode.endpoints)]
+
+            table = "{0} AS {1}".format(graph.nodes[node_id].sort, node_id)
+            if not from_:
+                from_.append(table)
+                where += conditions
+                where_params += params
+            else:
+                from_.append("JOIN " + table + (" ON " if conditions else "") + " AND ".join(conditions))
+                from_params += params
+
+        return " ".join(from_), from_params, where, where_params
+
+    #  query the database, unless the result is still cached from an earlier request
+    def _cached_query(self, query, params):
+        key = (self.db_info.key(), query, tuple(params))
+        result = result_cache.get(key)
+        if result is None:
+            result = _query(self.db_info, query, params)
+            result_cache.put(key, result)
+        return result
+
+    # the snapshot of the database (see dbnav.snapshot), if one has been taken and it can answer the query for the
+    # given window of graph (or, without a graph, the sort counts)
+    def _snapshot(self, graph=None, window=None, rwindow=None):
+        snapshot = snapshots.get(self.db_info.key())
+        if snapshot is not None and snapshot.supports(self, graph, window, rwindow):
+            return snapshot
+        return None
+
+    # check if the graph is trivial (isolated node).
+    # theory-wise, returning an empty table is wrong; but it's convenient
+    @staticmethod
+    def _is_trivial(graph):
+        return len(graph.nodes) == 1 and len(graph.rnodes) == 0 and next(iter(graph.nodes.values())).sort is None
+
+    def result_table(self, graph, window, rwindow, limit=None, offset=0):
+
+        if self._is_trivial(graph):
+            return Table([], [])
 
-        header = [rename(colname) for colname in header]
+        snapshot = self._snapshot(graph, window, rwindow)
+        if snapshot is not None:
+            header, rows = snapshot.result_table(self, graph, window, rwindow, limit, offset)
+        else:
+            query, params = self._to_sql(graph, window, rwindow, limit, offset)
+            header, rows = self._cached_query(query, params)
+        header = [self._column_name(graph, colname) for colname in header]
         return Table(header, rows)
 
-    def stats(self, sort, table, lock_set):
-
-        if not table.header:
-            select = 'SELECT "{0}" AS sort, COUNT(*) AS count FROM {0}'
-            parts = [select.format(table_name) for table_name in self.sorts]
-            query = " UNION ".join(parts)
+    # the unpaged result table, which is only fetched if its rows are accessed. until then, table.count() only
+    # queries the number of rows.
+    def lazy_result_table(self, graph, window, rwindow):
 
-            cnx = mysql.connector.connect(user=self.db_info.user, password=self.db_info.password,
-                                          host=self.db_info.host, database=self.db_info.database)
-            cursor = cnx.cursor()
+        if self._is_trivial(graph):
+            return Table([], [])
 
-            # # the information_schema values turned out to be unreliable for InnoDB tables
-            # query = "SELECT table_name,table_rows FROM information_schema.tables WHERE table_schema='{0}'"
-            cursor.execute(query)
-            rows = cursor.fetchall()
+        return LazyTable(lambda: self.result_table(graph, window, rwindow),
+                         lambda: self.result_count(graph, window, rwindow))
+
+    # the unpaged result table, with its rows fetched from the cursor in batches while they are iterated, so that
+    # it is never held in memory as a whole. a pooled connection is held until the rows are exhausted or closed.
+    def iter_result_table(self, graph, window, rwindow, batch_size=1000):
+
+        if self._is_trivial(graph):
+            return Table([], iter([]))
+
+        snapshot = self._snapshot(graph, window, rwindow)
+        if snapshot is not None:
+            header, rows = snapshot.result_table(self, graph, window, rwindow)
+            return Table([self._column_name(graph, colname) for colname in header], iter(rows))
+
+        query, params = self._to_sql(graph, window, rwindow)
+        with ExitStack() as stack:
+            cnx = stack.enter_context(self.db_info.connection())
+            cursor = self.db_info.dialect.execute(cnx, query, params)
+            header = [self._column_name(graph, t[0]) for t in cursor.description]
+            # from here on, the connection is given back by the row generator
+            stack = stack.pop_all()
+
+        def rows():
+            with stack:
+                batch = cursor.fetchmany(batch_size)
+                while batch:
+                    yield from batch
+                    batch = cursor.fetchmany(batch_size)
+
+        return Table(header, rows())
+
+    # the header of a result table column, for the column name given in _to_sql
+    def _column_name(self, graph, colname):
+
+        type_, key = colname.split(":",1)
+        assert(type_ in ["node", "rnode", "display"])
+
+        if type_ == "node":
+            node = graph.nodes[key]
+            return "{0}:{1}".format(node.sort, key)
+
+        elif type_ == "rnode":
+            rnode = graph.rnodes[key]
+            mva = self.rcontexts[rnode.context_id].mva
+            return "{0}({1})".format(mva.name, ",".join(rnode.endpoints))
+
+        # TODO: maybe refactor to get rid of complicated encoding scheme (see remark in _to_sql function)
+        elif type_ == "display":
+            length1, keys = key.split(":",1)
+            length1 = int(length1)
+            assert keys[length1] == ":"
+            node_id = keys[:length1]
+            context_id = keys[length1+1:]
+            mva = self.rcontexts[context_id].mva
+            return "{0}.{1}".format(node_id, mva.name)
+
+    # number of rows of the (unpaged) result table
+    def result_count(self, graph, window, rwindow):
+
+        if self._is_trivial(graph):
+            return 0
+
+        snapshot = self._snapshot(graph, window, rwindow)
+        if snapshot is not None:
+            return snapshot.result_count(self, graph, window, rwindow)
+
+        query, params = self._to_sql(graph, window, rwindow, count=True)
+        header, rows = self._cached_query(query, params)
+        return int(rows[0][0])
+
+    # for each link returned by neighbors() for the sort of a node: the number of objects in the node's extent which
+    # have at least one such link (with the top label of its context), i.e. which would remain if the link was
+    # added to the graph. the counts are keyed by "roleID#contextID", and computed by conditional aggregation, so
+    # that they take a single pass over the extent.
+    def refinement_counts(self, graph, node_id):
+
+        links = self.neighbors(graph.nodes[node_id].sort)
+        if self._is_trivial(graph) or not links:
+            return {}
+
+        snapshot = self._snapshot(graph)
+        counts = snapshot.refinement_counts(self, graph, node_id) if snapshot is not None else None
+        if counts is not None:
+            return counts
+
+        columns = []
+        params = []
+        for i, link in enumerate(links):
+            rcontext = self.rcontexts[link["linkID"]]
+            args = ["r{0}_{1}".format(i, j) for j in range(len(rcontext.sort))]
+            args[link["roleID"]-1] = node_id
+            condition, condition_params = rcontext.pattern_sql(rcontext.top(), args)
+            others = ["{0} AS {1}".format(s, x) for s, x in zip(rcontext.sort, args) if x != node_id]
+            if others:
+                condition = "EXISTS (SELECT 1 FROM {0} WHERE {1})".format(", ".join(others), condition)
+            columns.append("SUM(CASE WHEN {0} THEN 1 ELSE 0 END)".format(condition))
+            params += condition_params
+
+        query, query_params = self._to_sql(graph, [node_id], columns=columns)
+        header, rows = self._cached_query(query, params + query_params)
+        return {"{0}#{1}".format(link["roleID"], link["linkID"]): int(count or 0)
+                for link, count in zip(links, rows[0])}
+
+    # frequencies of the values of an rnode's mva in its rextent, as a list of (value, count) pairs; computed by
+    # the database, so that only the aggregated rows are transferred. if prefix_length is given, values are
+    # counted by their prefixes of that length. if limit is given, only the most frequent values are returned.
+    def value_frequencies(self, graph, rnode_id, prefix_length=None, limit=None):
+
+        snapshot = self._snapshot(graph, graph.rnodes[rnode_id].endpoints, [rnode_id])
+        if snapshot is not None:
+            return snapshot.value_frequencies(self, graph, rnode_id, prefix_length, limit)
+
+        value = "t.`rnode:{0}`".format(rnode_id)
+        if prefix_length is not None:
+            value = self.db_info.dialect.substring(value, 1, prefix_length)
+        return self._group_count(graph, rnode_id, value, "2 DESC, 1", limit)
+
+    # number of rows in an rnode's rextent per year of the mva value, as a list of (year, count) pairs
+    def value_histogram(self, graph, rnode_id):
+        snapshot = self._snapshot(graph, graph.rnodes[rnode_id].endpoints, [rnode_id])
+        if snapshot is not None:
+            return snapshot.value_histogram(self, graph, rnode_id)
+        return self._group_count(graph, rnode_id, self.db_info.dialect.year("t.`rnode:{0}`".format(rnode_id)), "1")
+
+    def _group_count(self, graph, rnode_id, term, order, limit=None):
+
+        rnode = graph.rnodes[rnode_id]
+        query, params = self._to_sql(graph, rnode.endpoints, [rnode_id])
+        query = "SELECT {0} AS value, COUNT(*) AS count FROM ({1}) AS t GROUP BY 1 ORDER BY {2}".format(
+            term, query, order)
+        if limit is not None:
+            query += " LIMIT {0}".format(int(limit))
+
+        header, rows = self._cached_query(query, params)
+        return [(row[0], int(row[1])) for row in rows]
+
+    # table may be a LazyTable; only its number of rows is used
+    def stats(self, sort, table, lock_set):
 
-            cursor.close()
-            cnx.close()
+        if sort is None:  # the isolated start node
+            counts = self.sort_counts()
 
             attributes = []
             object_count = 0
 
-            for row in rows:
-                attributes.append({"name": row[0], "attributeID": row[0], "count": int(row[1]),
-                                   "selected": False, "disabled": int(row[1]) == 0})
-                object_count += int(row[1])
+            for s in self.sorts:
+                attributes.append({"name": s, "attributeID": s, "count": counts[s],
+                                   "selected": False, "disabled": counts[s] == 0})
+                object_count += counts[s]
 
             stats = {"sorts": attributes, "objectCount": object_count}
             return stats
 
         else:
+            count = table.count()
             attributes = []
             for s in self.sorts:
                 if s == sort:
-                    attributes.append({"name": s, "attributeID": s, "count": len(table.rows),
+                    attributes.append({"name": s, "attributeID": s, "count": count,
                                        "selected": True, "disabled": s in lock_set})
                 else:
                     attributes.append({"name": s, "attributeID": s, "count": 0,
                                        "selected": False, "disabled": True})
             attributes.sort(key=lambda x: x["name"])
 
-            stats = {"sorts": attributes, "objectCount": len(table.rows)}
+            stats = {"sorts": attributes, "objectCount": count}
             return stats
 
+    # the number of objects of each sort. counting them means scanning every table, so the counts are cached (see
+    # cache.sort_counts), and recounted in the background once they are older than sort_counts_refresh.
+    def sort_counts(self):
+
+        snapshot = self._snapshot()
+        if snapshot is not None:
+            return snapshot.sort_counts(self.sorts)
+
+        key = (self.db_info.key(), tuple(self.sorts))
+        entry = sort_counts.get(key)
+
+        if entry is None:
+            if self.estimate_sort_counts:
+                counts = self._estimated_sort_counts()
+                sort_counts.put(key, (counts, time.monotonic(), False))
+                self._refresh_sort_counts(key)
+            else:
+                counts = self._exact_sort_counts()
+                sort_counts.put(key, (counts, time.monotonic(), True))
+            return counts
+
+        counts, counted, exact = entry
+        if not exact or time.monotonic() - counted > sort_counts_refresh:
+            self._refresh_sort_counts(key)
+        return counts
+
+    def _exact_sort_counts(self):
+        select = "SELECT '{0}' AS sort, COUNT(*) AS count FROM {0}"
+        query = " UNION ".join(select.format(table_name) for table_name in self.sorts)
+        header, rows = _query(self.db_info, query)
+        return {row[0]: int(row[1]) for row in rows}
+
+    # the estimates are only used until the exact counts are known. without table statistics, the sorts are counted.
+    def _estimated_sort_counts(self):
+        table_rows = self.db_info.dialect.table_rows_query(self.db_info.database)
+        if table_rows is None:
+            return self._exact_sort_counts()
+        header, rows = _query(self.db_info, *table_rows)
+        estimates = {row[0]: int(row[1] or 0) for row in rows}
+        return {s: estimates.get(s, 0) for s in self.sorts}
+
+    # recounts the sorts in a background thread, unless this is already being done
+    def _refresh_sort_counts(self, key):
+
+        with _refreshing_lock:
+            if key in _refreshing:
+                return
+            _refreshing.add(key)
+
+        def refresh():
+            try:
+                sort_counts.put(key, (self._exact_sort_counts(), time.monotonic(), True))
+            finally:
+                with _refreshing_lock:
+                    _refreshing.discard(key)
+
+        threading.Thread(target=refresh, name="dbnav-sort-counts", daemon=True).start()
+
     def load_contents(self):
-        cnx = mysql.connector.connect(user=self.db_info.user, password=self.db_info.password,
-                                      host=self.db_info.host, database=self.db_info.database)
-
-        cursor1 = cnx.cursor()
-        query1 = "SELECT column_name,table_name,data_type FROM information_schema.columns WHERE table_schema='{0}'"
-        cursor1.execute(query1.format(self.db_info.database))
-        header1 = [t[0] for t in cursor1.description]
-        rows1 = cursor1.fetchall()
-        cursor1.close()
-
-        cursor2 = cnx.cursor()
-        query2 = ("SELECT t1.constraint_name, t2.constraint_type, t1.table_name, t1.column_name, "
-                  + "t1.referenced_table_name, t1.referenced_column_name "
-                  + "FROM information_schema.key_column_usage AS t1 "
-                  + "LEFT JOIN information_schema.table_constraints AS t2 "
-                  + "ON t1.constraint_name = t2.constraint_name AND t1.table_schema = t2.table_schema "
-                  + "AND t1.table_name = t2.table_name "
-                  + "WHERE t1.table_schema = '{0}'")
-        cursor2.execute(query2.format(self.db_info.database))
-        rows2 = cursor2.fetchall()
-        cursor2.close()
-
-        cnx.close()
+        with self.db_info.connection() as cnx:
+            rows1, rows2 = self.db_info.dialect.schema(cnx, self.db_info.database)
 
         columns = {}
-        assert(header1[0] == "COLUMN_NAME" and header1[1] == "TABLE_NAME" and header1[2] == "DATA_TYPE")
 
         for row in rows1:
             column = row[0]
@@ -550,14 +888,13 @@ class DBContextFamily(object):
 
         for sort in self.output:
             primary_keys = self.output[sort]
-            if len(primary_keys) == 0:
-                pk_list = ",', ',".join(["{{0}}.{0}".format(column) for column in columns[sort]])
-                self.output[sort] = "CONCAT({0})".format(pk_list)
-            elif len(primary_keys) == 1:
+            if len(primary_keys) == 1:
                 self.output[sort] = "{{0}}.{0}".format(primary_keys[0])
             else:
-                pk_list = ",', ',".join(["{{0}}.{0}".format(column) for column in primary_keys])
-                self.output[sort] = "CONCAT({0})".format(pk_list)
+                terms = []
+                for column in primary_keys or columns[sort]:
+                    terms += ["', '", "{{0}}.{0}".format(column)]
+                self.output[sort] = self.db_info.dialect.concat(terms[1:])
 
     def to_dict(self):
         return {
@@ -571,7 +908,7 @@ class DBContextFamily(object):
     @classmethod
     def from_dict(cls, obj):
         pcf = DBContextFamily(obj["db_info"].user, obj["db_info"].password,
-                              obj["db_info"].host, obj["db_info"].database)
+                              obj["db_info"].host, obj["db_info"].database, obj["db_info"].backend)
         pcf.output = obj["output"]
         pcf.mvas = obj["mvas"]
         pcf.rcontexts = obj["rcontexts"]
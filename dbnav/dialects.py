@@ -0,0 +1,331 @@
+import datetime
+import re
+import sqlite3
+import urllib.parse
+from collections import OrderedDict
+
+try:
+    import mysql.connector
+except ImportError:  # only needed for bindings of MySQL databases
+    mysql = None
+
+
+# a dialect connects to a kind of database, runs queries on it, reads its schema, and provides the sql terms which
+# are not written the same way by all databases. queries are written with %s placeholders for their parameters,
+# which the dialect translates if its driver uses a different style.
+class Dialect(object):
+
+    name = None
+
+    def connect(self, db_info):
+        raise NotImplementedError
+
+    # the health check of pooled connections (see ConnectionPool)
+    def is_connected(self, cnx):
+        raise NotImplementedError
+
+    # executes a query on cnx and returns the cursor. the cursor is closed by the caller if params is None.
+    def execute(self, cnx, query, params=None):
+        raise NotImplementedError
+
+    # the columns of all tables, as (column, table, datatype) rows, and the columns of their primary and foreign keys
+    # as (constraint name, "PRIMARY KEY" or "FOREIGN KEY", table, column, referenced table, referenced column) rows
+    def schema(self, cnx, database):
+        raise NotImplementedError
+
+    # a query for the (estimated) number of rows per table, with its parameters, or None if there is no such
+    # statistic
+    def table_rows_query(self, database):
+        return None
+
+    def if_(self, condition, then, else_):
+        return "CASE WHEN {0} THEN {1} ELSE {2} END".format(condition, then, else_)
+
+    def concat(self, terms):
+        return "CONCAT({0})".format(",".join(terms))
+
+    def year(self, term):
+        return "YEAR({0})".format(term)
+
+    def substring(self, term, start, length):
+        return "SUBSTRING({0},{1},{2})".format(term, int(start), int(length))
+
+    def column(self, name):
+        return "{{0}}.{0}".format(name)
+
+    # the sqldef of a foreign key mva: 1 if the column of the first object references the second object, else 0
+    def foreign_key(self, column1, column2):
+        return self.if_("{{0}}.{0}={{1}}.{1}".format(column1, column2), 1, 0)
+
+
+# number of prepared statements that are kept open per connection
+max_statements = 32
+
+
+class MySQLDialect(Dialect):
+
+    name = "mysql"
+
+    def connect(self, db_info):
+        if mysql is None:
+            raise RuntimeError("MySQL databases require the mysql-connector-python package")
+        # autocommit, so that a pooled connection doesn't keep reading from the snapshot of its first query
+        return mysql.connector.connect(user=db_info.user, password=db_info.password, host=db_info.host,
+                                       database=db_info.database, autocommit=True)
+
+    def is_connected(self, cnx):
+        return cnx.is_connected()
+
+    # a query with params is prepared once per pooled connection and template, so that navigation queries which
+    # only differ in their labels share the parsing and planning work. the cursors of prepared statements are kept
+    # with the connection, and must not be closed by the caller.
+    def execute(self, cnx, query, params=None):
+
+        if params is None:
+            cursor = cnx.cursor()
+            cursor.execute(query)
+            return cursor
+
+        statements = getattr(cnx, "dbnav_statements", None)
+        if statements is None:
+            statements = cnx.dbnav_statements = OrderedDict()  # query -> (query, cursor), least recently used first
+
+        if query in statements:
+            statements.move_to_end(query)
+            # the cursor only reuses its statement if it is given the same string object again
+            query, cursor = statements[query]
+        else:
+            cursor = cnx.cursor(prepared=True)
+            statements[query] = (query, cursor)
+            while len(statements) > max_statements:
+                old_query, old_cursor = statements.popitem(last=False)[1]
+                old_cursor.close()
+
+        cursor.execute(query, tuple(params))
+        return cursor
+
+    def schema(self, cnx, database):
+
+        cursor1 = cnx.cursor()
+        query1 = "SELECT column_name,table_name,data_type FROM information_schema.columns WHERE table_schema='{0}'"
+        cursor1.execute(query1.format(database))
+        header1 = [t[0] for t in cursor1.description]
+        rows1 = cursor1.fetchall()
+        cursor1.close()
+        assert(header1[0] == "COLUMN_NAME" and header1[1] == "TABLE_NAME" and header1[2] == "DATA_TYPE")
+
+        cursor2 = cnx.cursor()
+        query2 = ("SELECT t1.constraint_name, t2.constraint_type, t1.table_name, t1.column_name, "
+                  + "t1.referenced_table_name, t1.referenced_column_name "
+                  + "FROM information_schema.key_column_usage AS t1 "
+                  + "LEFT JOIN information_schema.table_constraints AS t2 "
+                  + "ON t1.constraint_name = t2.constraint_name AND t1.table_schema = t2.table_schema "
+                  + "AND t1.table_name = t2.table_name "
+                  + "WHERE t1.table_schema = '{0}'")
+        cursor2.execute(query2.format(database))
+        rows2 = cursor2.fetchall()
+        cursor2.close()
+
+        return rows1, rows2
+
+    # the table_rows of information_schema are unreliable for InnoDB tables
+    def table_rows_query(self, database):
+        return "SELECT table_name, table_rows FROM information_schema.tables WHERE table_schema=%s", [database]
+
+    def if_(self, condition, then, else_):
+        return "IF({0},{1},{2})".format(condition, then, else_)
+
+
+# values which aren't valid dates (e.g. MySQL's zero date) are left as strings
+def _convert_date(value):
+    try:
+        return datetime.date.fromisoformat(value.decode())
+    except ValueError:
+        return value.decode()
+
+
+def _convert_datetime(value):
+    try:
+        return datetime.datetime.fromisoformat(value.decode())
+    except ValueError:
+        return value.decode()
+
+
+# an SQLite database in a local file, whose name is the database of the binding (user, password and host are not
+# used). SQLite keeps no column types, so dates are converted by the types declared for the columns.
+class SQLiteDialect(Dialect):
+
+    name = "sqlite"
+
+    def connect(self, db_info):
+        # converters are registered globally, but only apply to connections which ask for them
+        sqlite3.register_converter("date", _convert_date)
+        sqlite3.register_converter("datetime", _convert_datetime)
+        # pooled connections are used by one thread at a time, but not always by the same one. the database is
+        # opened read-only, so that a mistyped file name fails instead of creating an empty database.
+        uri = "file:{0}?mode=ro".format(urllib.parse.quote(db_info.database))
+        return sqlite3.connect(uri, uri=True, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False,
+                               isolation_level=None)
+
+    def is_connected(self, cnx):
+        cnx.execute("SELECT 1").fetchall()
+        return True
+
+    # sqlite3 caches the prepared statements of a connection itself
+    def execute(self, cnx, query, params=None):
+        cursor = cnx.cursor()
+        if params is None:
+            cursor.execute(query)
+        else:
+            cursor.execute(_placeholders.sub(lambda m: "?" if m.group() == "%s" else m.group(), query),
+                           tuple(params))
+        return cursor
+
+    def schema(self, cnx, database):
+
+        tables = [row[0] for row in cnx.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite!_%' ESCAPE '!'")]
+
+        rows1 = []
+        rows2 = []
+        for table in tables:
+            quoted = '"{0}"'.format(table.replace('"', '""'))
+
+            primary_key = []
+            for cid, name, type_, notnull, default, pk in cnx.execute("PRAGMA table_info({0})".format(quoted)):
+                rows1.append((name, table, _base_type(type_)))
+                if pk:
+                    primary_key.append((pk, name))
+            for pk, name in sorted(primary_key):
+                rows2.append(("PRIMARY", "PRIMARY KEY", table, name, None, None))
+
+            # PRAGMA foreign_key_list doesn't report the names of the constraints, so they are taken from the
+            # CREATE TABLE statement
+            sql, = cnx.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+            names = {_unquote(columns): name for name, columns in _constraint_pattern.findall(sql)}
+            for row in cnx.execute("PRAGMA foreign_key_list({0})".format(quoted)):
+                id_, seq, referenced_table, column, referenced_column = row[:5]
+                name = names.get(column, "{0}_{1}".format(table, column))
+                rows2.append((name, "FOREIGN KEY", table, column, referenced_table, referenced_column))
+
+        return rows1, rows2
+
+    def concat(self, terms):
+        return "(" + " || ".join(terms) + ")"
+
+    def year(self, term):
+        return "CAST(strftime('%Y',{0}) AS INTEGER)".format(term)
+
+
+# the %s placeholders of a query, and the quoted strings and names, in which a %s is not a placeholder (as in the
+# RE_SQL_FIND_PARAM of mysql-connector)
+_placeholders = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|%s")
+
+
+_constraint_pattern = re.compile(r'CONSTRAINT\s+[`"]?(\w+)[`"]?\s+FOREIGN\s+KEY\s*\(([^)]*)\)', re.IGNORECASE)
+
+
+def _unquote(name):
+    return name.strip().strip('`"')
+
+
+# the type name without its size and options, as in the data_type of MySQL's information_schema
+def _base_type(declared):
+    match = re.match(r"\s*(\w+)", declared)
+    return match.group(1).lower() if match else ""
+
+
+dialects = {dialect.name: dialect for dialect in [MySQLDialect(), SQLiteDialect()]}
+
+
+# statements of a MySQL dump (as in resources/sqldumps) which SQLite doesn't need, or which don't concern the tables
+_skipped = re.compile(r"(SET|START TRANSACTION|COMMIT|CREATE DATABASE|USE|LOCK TABLES|UNLOCK TABLES|DROP DATABASE)\b",
+                      re.IGNORECASE)
+
+_tokens = re.compile(r"'(?:[^'\\]|\\.|'')*'|`[^`]*`|--[^\n]*|#[^\n]*|/\*.*?\*/|;|0x[0-9A-Fa-f]+|[^'`;/#0-]+|.",
+                     re.DOTALL)
+
+_escapes = {"0": "\0", "b": "\b", "n": "\n", "r": "\r", "t": "\t", "Z": "\x1a"}
+
+
+# the statements of a MySQL dump, without comments, and with string and hex literals written as SQLite reads them
+def _statements(text):
+
+    statement = []
+    for token in _tokens.findall(text):
+        if token == ";":
+            yield "".join(statement).strip()
+            statement = []
+        elif token.startswith("'"):
+            value = re.sub(r"\\(.)", lambda m: _escapes.get(m.group(1), m.group(1)), token[1:-1].replace("''", "'"))
+            statement.append("'" + value.replace("'", "''") + "'")
+        elif token.startswith("0x"):
+            statement.append("X'{0}'".format(token[2:]))
+        elif not token.startswith(("--", "#", "/*")):
+            statement.append(token)
+    if "".join(statement).strip():
+        yield "".join(statement).strip()
+
+
+# imports a MySQL dump into the SQLite database fname. the keys, which MySQL dumps add with ALTER TABLE after the
+# data, are moved into the CREATE TABLE statements (SQLite can't add them to an existing table), and the other
+# indexes are created after the data has been inserted.
+def load_dump(dump_fname, fname):
+
+    with open(dump_fname, encoding="utf-8") as fp:
+        text = fp.read()
+
+    tables = OrderedDict()  # table -> column definitions and table constraints
+    inserts = []
+    indexes = []
+
+    for statement in _statements(text):
+        if not statement or _skipped.match(statement):
+            continue
+
+        match = re.match(r"CREATE TABLE (?:IF NOT EXISTS )?`?(\w+)`?\s*\((.*)\)[^)]*$", statement,
+                         re.IGNORECASE | re.DOTALL)
+        if match:
+            definitions = [re.sub(r"\s+(CHARACTER SET|COLLATE)\s+\w+", "", line.strip().rstrip(","))
+                           for line in match.group(2).split("\n") if line.strip()]
+            tables[match.group(1)] = definitions
+            continue
+
+        match = re.match(r"ALTER TABLE `?(\w+)`?\s+(.*)$", statement, re.IGNORECASE | re.DOTALL)
+        if match:
+            table, clauses = match.groups()
+            for columns in re.findall(r"ADD PRIMARY KEY\s*(\([^)]*\))", clauses, re.IGNORECASE):
+                tables[table].append("PRIMARY KEY " + columns)
+            for unique, name, columns in re.findall(r"ADD (UNIQUE )?(?:KEY|INDEX) `?(\w+)`?\s*(\([^)]*\))", clauses,
+                                                    re.IGNORECASE):
+                indexes.append("CREATE {0}INDEX `{1}_{2}` ON `{1}` {3}".format(unique.upper(), table, name, columns))
+            for constraint in re.findall(r"ADD (CONSTRAINT .*?FOREIGN KEY.*?REFERENCES `?\w+`?\s*\([^)]*\))",
+                                         clauses, re.IGNORECASE | re.DOTALL):
+                tables[table].append(constraint)
+            # MODIFY only adds AUTO_INCREMENT, which isn't needed for navigation
+            continue
+
+        if re.match(r"INSERT\b", statement, re.IGNORECASE):
+            inserts.append(statement)
+            continue
+
+        raise ValueError("Unsupported statement in {0}: {1}".format(dump_fname, statement[:80]))
+
+    cnx = sqlite3.connect(fname)
+    try:
+        with cnx:
+            for table, definitions in tables.items():
+                cnx.execute("DROP TABLE IF EXISTS `{0}`".format(table))
+                cnx.execute("CREATE TABLE `{0}` (\n  {1}\n)".format(table, ",\n  ".join(definitions)))
+            for statement in inserts + indexes:
+                cnx.execute(statement)
+            cnx.execute("ANALYZE")
+    finally:
+        cnx.close()
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 3:
+        sys.exit("usage: python -m dbnav.dialects DUMP.sql DATABASE.sqlite")
+    load_dump(sys.argv[1], sys.argv[2])
@@ -1,20 +1,35 @@
 from dbnav.table import Table
 
+try:
+    import numpy
+except ImportError:  # only needed for FormalContext.matrix
+    numpy = None
 
+
+# the incidence is kept as one bitset per attribute (a Python int, whose bit i is set if the object with index i has
+# the attribute), so that extents and intents are computed by bitwise ANDs instead of a lookup per object and
+# attribute. objects are indexed in the order in which they are added.
 class FormalContext(object):
 
     def __init__(self, atts=None):
         atts = atts or []
         self.objects = {}
         self.attributes = set(atts)
-        self.incidence = set()
         self._next_id = 1
+        self._index = {}  # obj_id -> index of its bit
+        self._ids = []  # index -> obj_id
+        self._columns = {}  # attribute -> bitset of the objects which have it
+        self._all = 0  # bitset of self.objects
+        # the bits which have been set since the bitsets were last read, as attribute -> list of indices (None for
+        # self._all). they are added to the bitsets at once, as each change of a bitset copies the whole integer.
+        self._pending = {}
 
     def add_object(self, obj, atts=None):
         atts = atts or []
         obj_id = "g" + str(self._next_id)
         self._next_id += 1
         self.objects[obj_id] = obj
+        self._pending.setdefault(None, []).append(self._position(obj_id))
         for m in atts:
             self.set_incidence(obj_id, m)
         return obj_id
@@ -23,20 +38,75 @@ class FormalContext(object):
         self.attributes.add(m)
 
     def set_incidence(self, obj_id, m):
-        self.incidence.add((obj_id, m))
+        self._pending.setdefault(m, []).append(self._position(obj_id))
 
     def unset_incidence(self, obj_id, m):
-        self.incidence.remove((obj_id, m))
+        if not self.has(obj_id, m):
+            raise KeyError((obj_id, m))
+        self._columns[m] &= ~(1 << self._index[obj_id])
 
     def has(self, obj_id, m):
-        # According to the Python 3.6 reference, Sect 6.10.2, "x in y" is equivalent to "any(x is e or x==e for e in y)"
-        return (obj_id, m) in self.incidence
+        self._flush()
+        index = self._index.get(obj_id)
+        return index is not None and (self._columns.get(m, 0) >> index) & 1 == 1
 
     def extent(self, atts):
-        return [(obj_id, obj) for obj_id, obj in self.objects.items() if all(self.has(obj_id, m) for m in atts)]
+        self._flush()
+        bits = self._all
+        for m in atts:
+            bits &= self._columns.get(m, 0)
+        return [(self._ids[i], self.objects[self._ids[i]]) for i in _members(bits)]
 
     def intent(self, obj_ids):
-        return [m for m in self.attributes if all(self.has(obj_id, m) for obj_id in obj_ids)]
+        self._flush()
+        if any(obj_id not in self._index for obj_id in obj_ids):  # an unknown object has no attributes
+            return []
+        bits = _bitset([self._index[obj_id] for obj_id in obj_ids], len(self._ids))
+        return [m for m in self.attributes if self._columns.get(m, 0) & bits == bits]
+
+    # the (obj_id, attribute) pairs of the incidence relation, as they were stored before there were bitsets
+    @property
+    def incidence(self):
+        self._flush()
+        return {(self._ids[i], m) for m, bits in self._columns.items() for i in _members(bits)}
+
+    @incidence.setter
+    def incidence(self, pairs):
+        self._columns = {}
+        self._pending = {m: indices for m, indices in self._pending.items() if m is None}
+        for obj_id, m in pairs:
+            self.set_incidence(obj_id, m)
+
+    # the incidence as a boolean matrix, with a row per object (in the order of self.objects) and a column per
+    # attribute (in the given order, by default sorted). requires numpy.
+    def matrix(self, atts=None):
+        if numpy is None:
+            raise RuntimeError("The incidence matrix requires the numpy package")
+        self._flush()
+        atts = sorted(self.attributes) if atts is None else atts
+        rows = numpy.array([self._index[obj_id] for obj_id in self.objects], dtype=numpy.int64)
+        size = (len(self._ids) + 7) // 8
+        columns = [numpy.unpackbits(numpy.frombuffer(self._columns.get(m, 0).to_bytes(size, "little"), numpy.uint8),
+                                    bitorder="little")[rows] for m in atts]
+        return numpy.array(columns, dtype=bool).T.reshape(len(rows), len(atts))
+
+    # the index of an object's bit, which is assigned when the object is first seen
+    def _position(self, obj_id):
+        index = self._index.get(obj_id)
+        if index is None:
+            index = self._index[obj_id] = len(self._ids)
+            self._ids.append(obj_id)
+        return index
+
+    def _flush(self):
+        if not self._pending:
+            return
+        for m, indices in self._pending.items():
+            if m is None:
+                self._all |= _bitset(indices, len(self._ids))
+            else:
+                self._columns[m] = self._columns.get(m, 0) | _bitset(indices, len(self._ids))
+        self._pending = {}
 
     def to_dict(self):
         return {
@@ -48,14 +118,32 @@ class FormalContext(object):
 
     @classmethod
     def from_dict(cls, obj):
-        context = FormalContext()
-        context.objects = obj["objects"]
-        context.attributes = obj["attributes"]
+        context = FormalContext(obj["attributes"])
+        for obj_id, g in obj["objects"].items():
+            context.objects[obj_id] = g
+            context._pending.setdefault(None, []).append(context._position(obj_id))
         context.incidence = [tuple(x) for x in obj["incidence"]]
         context._next_id = obj["_next_id"]
         return context
 
 
+# the bitset of the given indices, built in a buffer of size bits
+def _bitset(indices, size):
+    buffer = bytearray((size + 7) // 8)
+    for i in indices:
+        buffer[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(buffer, "little")
+
+
+# the indices of the set bits of a bitset, in ascending order
+def _members(bits):
+    digits = bin(bits)[:1:-1]  # least significant bit first, without the "0b" prefix
+    i = digits.find("1")
+    while i >= 0:
+        yield i
+        i = digits.find("1", i + 1)
+
+
 class RelationContext(object):
 
     def __init__(self, rsort, atts=None):
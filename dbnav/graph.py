@@ -213,17 +213,32 @@ class Graph(object):
 
     def rstats(self, rnode_id):
 
-        table = self.rextent(rnode_id)
-        label = self.rnodes[rnode_id].label
-        return self.get_context(rnode_id).stats(table, label)
+        return self.get_context(rnode_id).stats(self, rnode_id)
 
-    def extent(self, node_id):
+    # without a limit, the extent is a LazyTable, which is only fetched if its rows are needed
+    def extent(self, node_id, limit=None, offset=0):
         # passing "self" undoubtedly looks strange; it is a consequence of pcf being an attribute of graph;
         # TODO: rename this class e.g. navigation_state or semiconcept, pass self.graph instead of "self"
-        return self.pcf.result_table(self, [node_id], [])
+        if limit is None:
+            return self.pcf.lazy_result_table(self, [node_id], [])
+        return self.pcf.result_table(self, [node_id], [], limit, offset)
 
-    def rextent(self, rnode_id):
-        return self.pcf.result_table(self, self.rnodes[rnode_id].endpoints, [rnode_id])
+    def rextent(self, rnode_id, limit=None, offset=0):
+        if limit is None:
+            return self.pcf.lazy_result_table(self, self.rnodes[rnode_id].endpoints, [rnode_id])
+        return self.pcf.result_table(self, self.rnodes[rnode_id].endpoints, [rnode_id], limit, offset)
+
+    def iter_extent(self, node_id):
+        return self.pcf.iter_result_table(self, [node_id], [])
+
+    def iter_rextent(self, rnode_id):
+        return self.pcf.iter_result_table(self, self.rnodes[rnode_id].endpoints, [rnode_id])
+
+    def count(self, node_id):
+        return self.pcf.result_count(self, [node_id], [])
+
+    def rcount(self, rnode_id):
+        return self.pcf.result_count(self, self.rnodes[rnode_id].endpoints, [rnode_id])
 
     def to_dict(self):
         return {
@@ -0,0 +1,182 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class ConnectionPool(object):
+
+    # connections are handed out most-recently-used first, so that under light load a few warm connections are
+    # reused and the rest run into max_idle and get closed. a connection that has been idle for longer than
+    # check_after seconds is health-checked before it is handed out again.
+    def __init__(self, connect, name=None, max_size=8, timeout=30.0, max_idle=300.0, check_after=30.0,
+                 check=None):
+        self.connect = connect
+        self.name = name
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.check = check or (lambda cnx: cnx.is_connected())
+
+        self._idle = []  # (connection, release time) pairs, most recently released last
+        self._size = 0  # number of open connections, idle or in use
+        self._cond = threading.Condition()
+
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+        self.evictions = 0
+        self.failed_checks = 0
+
+    def acquire(self):
+
+        start = None
+        stale = []
+
+        with self._cond:
+            while True:
+                stale += self._evict_idle()
+                if self._idle:
+                    cnx, released = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    cnx, released = None, None
+                    break
+                if start is None:
+                    start = time.monotonic()
+                    self.waits += 1
+                remaining = self.timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self.timeouts += 1
+                    self.wait_time += time.monotonic() - start
+                    raise PoolTimeoutError("No connection available in pool {0} after {1}s".format(self.name,
+                                                                                                   self.timeout))
+                self._cond.wait(remaining)
+
+            if start is not None:
+                self.wait_time += time.monotonic() - start
+
+        for old in stale:
+            self._close(old)
+
+        if cnx is not None:
+            if time.monotonic() - released < self.check_after or self._healthy(cnx):
+                with self._cond:
+                    self.hits += 1
+                return cnx
+            self._close(cnx)
+            with self._cond:
+                self.failed_checks += 1
+
+        # the slot reserved above (or inherited from the failed connection) is given back if connecting fails
+        try:
+            cnx = self.connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self.misses += 1
+        return cnx
+
+    def release(self, cnx, discard=False):
+
+        with self._cond:
+            if discard:
+                self._size -= 1
+            else:
+                self._idle.append((cnx, time.monotonic()))
+            self._cond.notify()
+
+        if discard:
+            self._close(cnx)
+
+    # a connection on which an exception occurred may be left with unread results or a broken protocol state,
+    # so it is closed instead of being returned to the pool
+    @contextmanager
+    def connection(self):
+        cnx = self.acquire()
+        try:
+            yield cnx
+        except BaseException:
+            self.release(cnx, discard=True)
+            raise
+        else:
+            self.release(cnx)
+
+    def stats(self):
+        with self._cond:
+            requests = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": self._size,
+                "idle": len(self._idle),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else None,
+                "waits": self.waits,
+                "wait_time": self.wait_time,
+                "timeouts": self.timeouts,
+                "evictions": self.evictions,
+                "failed_checks": self.failed_checks,
+            }
+
+    def close(self):
+        with self._cond:
+            idle = [cnx for cnx, released in self._idle]
+            self._size -= len(idle)
+            self._idle = []
+        for cnx in idle:
+            self._close(cnx)
+
+    # must be called with self._cond held; the evicted connections are closed by the caller, outside the lock
+    def _evict_idle(self):
+        deadline = time.monotonic() - self.max_idle
+        stale = [cnx for cnx, released in self._idle if released < deadline]
+        if stale:
+            self._idle = [(cnx, released) for cnx, released in self._idle if released >= deadline]
+            self._size -= len(stale)
+            self.evictions += len(stale)
+        return stale
+
+    def _healthy(self, cnx):
+        try:
+            return self.check(cnx)
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(cnx):
+        try:
+            cnx.close()
+        except Exception:
+            pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, connect, **kwargs):
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(connect, **kwargs)
+            _pools[key] = pool
+        return pool
+
+
+def pool_stats():
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.stats() for pool in pools]
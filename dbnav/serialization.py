@@ -1,6 +1,24 @@
+import collections.abc
 import json
 import datetime
-import importlib
+from dbnav import dbcf, faceted_pcf, graph
+
+try:
+    import msgpack
+except ImportError:  # the binary encoding is optional
+    msgpack = None
+
+
+# the classes which can be decoded, by (module name, class name). the names are taken from the data, which may
+# come from a client (e.g. the body of an ajax request), so no other class is instantiated and no module is imported
+# on their behalf. (the dialects of dbnav.dialects aren't encoded, a DatabaseInfo only has the name of its backend.)
+_classes = {(cls.__module__, cls.__name__): cls for cls in [
+    dbcf.ManyValuedAttribute, dbcf.DBColumn, dbcf.ForeignKey, dbcf.BooleanFacet, dbcf.PrefixFacet,
+    dbcf.DateIntervalFacet, dbcf.DatabaseInfo, dbcf.DBContextFamily,
+    graph.Point, graph.Node, graph.RNode, graph.Graph,
+    faceted_pcf.FormalContext, faceted_pcf.RelationContext, faceted_pcf.ObjectTuple,
+    faceted_pcf.FacetedPowerContextFamily,
+]}
 
 
 def _object_hook(obj):
@@ -10,7 +28,7 @@ def _object_hook(obj):
 
     elif obj["_cls"] == "date":
         isodate = obj["_val"]
-        return datetime.datetime.strptime(isodate, "%Y-%m-%d").date()
+        return datetime.date(int(isodate[0:4]), int(isodate[5:7]), int(isodate[8:10]))
 
     # the datetime parsing below implements the functionality of datetime.fromisoformat in the Python 3.7 module
     # (which is not used itself because Python 3.7 is still recent). according to the documentation there,
@@ -69,8 +87,9 @@ def _object_hook(obj):
         return set(obj["_val"])
 
     else:
-        module = importlib.import_module(obj["_mod"])
-        cls = getattr(module, obj["_cls"])
+        cls = _classes.get((obj.get("_mod"), obj["_cls"]))
+        if cls is None:
+            raise ValueError("Unknown class {0}.{1}".format(obj.get("_mod"), obj["_cls"]))
         return cls.from_dict(obj)
 
 
@@ -106,14 +125,60 @@ def _json_default(obj):
         raise TypeError("Unserializable object {0} of type {1}".format(obj,type(obj)))
 
 
-def dump(obj, fp):
+# by default, the output is indented and sorted (which is what the binding files are stored as). with compact=True,
+# it is written without any whitespace and in the order of the dicts, which is considerably faster.
+def dump(obj, fp, compact=False):
+
+    if compact:
+        json.dump(obj, fp, default=_json_default, separators=(",", ":"))
+    else:
+        json.dump(obj, fp, default=_json_default, sort_keys=True, indent=4)
+
+
+def dumps(obj, compact=False):
+
+    if compact:
+        return json.dumps(obj, default=_json_default, separators=(",", ":"))
+    else:
+        return json.dumps(obj, default=_json_default, sort_keys=True, indent=4)
+
+
+# compact JSON, produced in chunks. dicts are written key by key, and iterators (e.g. generators) as arrays whose
+# items are only taken from them while they are written, so that large results don't have to be in memory at once.
+def iterdumps(obj):
+
+    if isinstance(obj, dict):
+        yield "{"
+        for i, (key, value) in enumerate(obj.items()):
+            yield ("," if i else "") + json.dumps(str(key)) + ":"
+            yield from iterdumps(value)
+        yield "}"
 
-    json.dump(obj, fp, default=_json_default, sort_keys=True, indent=4)
+    elif isinstance(obj, collections.abc.Iterator):
+        yield "["
+        for i, item in enumerate(obj):
+            if i:
+                yield ","
+            yield from iterdumps(item)
+        yield "]"
 
+    else:
+        yield json.dumps(obj, default=_json_default, separators=(",", ":"))
 
-def dumps(obj):
 
-    return json.dumps(obj, default=_json_default, sort_keys=True, indent=4)
+# the output of iterdumps as UTF-8, joined into chunks of about chunk_size bytes (e.g. for a streamed response)
+def iterdumps_chunks(obj, chunk_size=64 * 1024):
+
+    chunk = []
+    size = 0
+    for part in iterdumps(obj):
+        chunk.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield "".join(chunk).encode("utf-8")
+            chunk = []
+            size = 0
+    yield "".join(chunk).encode("utf-8")
 
 
 def load(fp):
@@ -124,3 +189,18 @@ def load(fp):
 def loads(string):
 
     return json.loads(string,object_hook=_object_hook)
+
+
+# the binary encoding (MessagePack) represents the same objects as the JSON encoding, and requires the msgpack package
+def packb(obj):
+
+    if msgpack is None:
+        raise RuntimeError("The binary encoding requires the msgpack package")
+    return msgpack.packb(obj, default=_json_default, use_bin_type=True)
+
+
+def unpackb(data):
+
+    if msgpack is None:
+        raise RuntimeError("The binary encoding requires the msgpack package")
+    return msgpack.unpackb(data, object_hook=_object_hook, raw=False)
@@ -0,0 +1,45 @@
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+
+# wsgiref.simple_server.WSGIServer with a larger listen backlog. with the default of 5, connections are reset when
+# more clients than that connect while a request is being handled.
+class SingleThreadWSGIServer(WSGIServer):
+
+    request_queue_size = 64
+
+
+# a WSGI server which handles requests on a fixed number of worker threads, so that a slow query of one user
+# doesn't block the others. the workers share the connection pools, caches and session store, which are synchronized
+# themselves; requests of the same session are serialized in app.wsgi.
+class ThreadPoolWSGIServer(SingleThreadWSGIServer):
+
+    def __init__(self, server_address, handler_class, workers=8):
+        super().__init__(server_address, handler_class)
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dbnav-worker")
+
+    def process_request(self, request, client_address):
+        self._executor.submit(self._process_request, request, client_address)
+
+    # cf. socketserver.ThreadingMixIn.process_request_thread
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown(wait=True)
+
+
+def make_server(host, port, app, workers=8, handler_class=WSGIRequestHandler):
+    if workers > 1:
+        server = ThreadPoolWSGIServer((host, port), handler_class, workers=workers)
+    else:
+        server = SingleThreadWSGIServer((host, port), handler_class)
+    server.set_app(app)
+    return server
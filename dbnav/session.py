@@ -0,0 +1,189 @@
+import copy
+import os
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from dbnav.graph import Graph
+from dbnav.serialization import dump, load
+from dbnav.storage import Storage
+
+
+class SessionStore(object):
+
+    # sessions which haven't been used for max_age seconds have expired
+    max_age = 24 * 60 * 60
+
+    # the requests of a session have to be handled one after the other, as they change its state in place. the
+    # sessions share a fixed number of locks, so that no lock has to be removed when its session expires.
+    _locks = [threading.Lock() for i in range(64)]
+
+    def lock(self, session_id):
+        return self._locks[hash(session_id) % len(self._locks)]
+
+    @staticmethod
+    def new_id():
+        return secrets.token_urlsafe(24)
+
+    def get(self, session_id):
+        raise NotImplementedError
+
+    def put(self, session_id, state):
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+
+# keeps the states of the max_sessions most recently used sessions. if a backing store is given, states are
+# written through to it, and sessions which have been evicted from memory are reloaded from it.
+class MemorySessionStore(SessionStore):
+
+    def __init__(self, max_sessions=1000, backing=None, max_age=SessionStore.max_age):
+        self.max_sessions = max_sessions
+        self.backing = backing
+        self.max_age = max_age
+        self._states = OrderedDict()  # session id -> (state, time of last use), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._states.pop(session_id, None)
+            if entry is not None and time.time() - entry[1] <= self.max_age:
+                self._states[session_id] = (entry[0], time.time())
+                return entry[0]
+        if self.backing is None:
+            return None
+        state = self.backing.get(session_id)
+        if state is not None:
+            self._insert(session_id, state)
+        return state
+
+    def put(self, session_id, state):
+        self._insert(session_id, state)
+        if self.backing is not None:
+            self.backing.put(session_id, state)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._states.pop(session_id, None)
+        if self.backing is not None:
+            self.backing.delete(session_id)
+
+    # the least recently used sessions are evicted beyond max_sessions, and the expired ones in any case
+    def _insert(self, session_id, state):
+        now = time.time()
+        with self._lock:
+            self._states.pop(session_id, None)
+            self._states[session_id] = (state, now)
+            while self._states and (len(self._states) > self.max_sessions
+                                    or now - next(iter(self._states.values()))[1] > self.max_age):
+                self._states.popitem(last=False)
+
+
+# stores each session state as a JSON file in the given directory. the modification time of a file is the last use
+# of its session; expired files are removed every cleanup_interval seconds (by the next put).
+#
+# the binding of a navigation state is not written, as it contains the password of the database. the graph is
+# stored without it, and the binding is read again by the pcf_name of the state.
+class FileSessionStore(SessionStore):
+
+    cleanup_interval = 60 * 60
+
+    def __init__(self, path, max_age=SessionStore.max_age):
+        self.path = path
+        self.max_age = max_age
+        self._next_cleanup = 0
+        os.makedirs(path, mode=0o700, exist_ok=True)
+
+    # session ids come from the client, and an invalid one (which could address a file outside self.path) is
+    # treated as the id of an unknown session
+    def get(self, session_id):
+        if not _valid_id(session_id):
+            return None
+        fname = self._filename(session_id)
+        try:
+            if time.time() - os.stat(fname).st_mtime > self.max_age:
+                return None
+            with open(fname, "r") as fp:
+                state = _decode(load(fp))
+            os.utime(fname)
+            return state
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put(self, session_id, state):
+        if not _valid_id(session_id):
+            return
+        # write to a temporary file first, so that a concurrent reader never sees a partially written state
+        fname = self._filename(session_id)
+        tmpname = "{0}.{1}.tmp".format(fname, threading.get_ident())
+        with open(tmpname, "w") as fp:
+            dump(_encode(state), fp, compact=True)
+        os.replace(tmpname, fname)
+
+        if time.time() >= self._next_cleanup:
+            self._next_cleanup = time.time() + self.cleanup_interval
+            self.cleanup()
+
+    # removes the files of expired sessions (and temporary files left behind by an interrupted put)
+    def cleanup(self):
+        now = time.time()
+        for entry in os.scandir(self.path):
+            try:
+                if entry.name.endswith((".json", ".tmp")) and now - entry.stat().st_mtime > self.max_age:
+                    os.remove(entry.path)
+            except FileNotFoundError:  # removed concurrently
+                pass
+
+    def delete(self, session_id):
+        if not _valid_id(session_id):
+            return
+        try:
+            os.remove(self._filename(session_id))
+        except FileNotFoundError:
+            pass
+
+    def _filename(self, session_id):
+        if not _valid_id(session_id):
+            raise ValueError("Invalid session id {0}".format(session_id))
+        return os.path.join(self.path, "{0}.json".format(session_id))
+
+
+def _valid_id(session_id):
+    return isinstance(session_id, str) and re.fullmatch(r"[A-Za-z0-9_-]+", session_id) is not None
+
+
+# the session store of the front ends. the navigation state of each client is kept on the server; the client only
+# holds the session id. if DBNAV_SESSION_DIR is set, states are also written there, so that they survive eviction
+# and restarts.
+def sessions_from_environ(environ=os.environ):
+    path = environ.get("DBNAV_SESSION_DIR")
+    return MemorySessionStore(backing=FileSessionStore(path) if path else None)
+
+
+# a copy of a state, which the action and the render of a request can change without affecting the stored state
+# until the request has succeeded. the binding of a navigation graph isn't changed by the actions, and is shared.
+def copy_state(state):
+    memo = {}
+    if isinstance(state.get("graph"), Graph):
+        memo[id(state["graph"].pcf)] = state["graph"].pcf
+    return copy.deepcopy(state, memo)
+
+
+def _encode(state):
+    if isinstance(state.get("graph"), Graph):
+        graph = {key: value for key, value in state["graph"].to_dict().items() if key != "pcf"}
+        state = dict(state, graph=graph)
+    return state
+
+
+def _decode(state):
+    if isinstance(state.get("graph"), dict):
+        try:
+            pcf = Storage.read(state["pcf_name"])
+        except FileNotFoundError:  # the binding has been deleted
+            return None
+        state["graph"] = Graph.from_dict(dict(state["graph"], pcf=pcf))
+    return state
@@ -0,0 +1,346 @@
+import datetime
+import json
+import threading
+import time
+from dbnav.cache import invalidate_binding, snapshots
+from dbnav.dbcf import BooleanFacet, DateIntervalFacet, ForeignKey, PrefixFacet
+
+try:
+    import numpy
+except ImportError:  # snapshots are optional
+    numpy = None
+
+
+# an in-memory copy of the database of a binding, from which navigation queries are answered without a round trip
+# to the database. each sort is a set of columns (numpy arrays with one entry per object), namely its output labels
+# and the values of its unary mvas. foreign keys are kept as pairs of row index arrays. the columns are integer coded
+# (each distinct value by its index in uniques), so that patterns are matched once per value, not once per row.
+#
+# a snapshot answers the queries of graphs whose rnodes are unary facets or foreign keys between different nodes,
+# and which have no cycles; for those, the extents are computed exactly by semi-joins along the foreign keys. other
+# queries, and queries which involve mvas that were added or changed after the snapshot was taken, go to the
+# database as before. a snapshot is not updated when the database changes; refresh() takes a new one.
+class Snapshot(object):
+
+    def __init__(self, pcf):
+
+        self.created = time.time()
+        self.output = dict(pcf.output)
+        self.labels = {}  # sort -> object array of the output labels
+        self.columns = {}  # mva_id -> _Column
+        self.links = {}  # mva_id -> (rows of the first sort, rows of the second sort)
+        self.mvas = {}  # mva_id -> (sort, sqldef) at the time of the snapshot
+
+        unary = {mva_id: mva for mva_id, mva in pcf.mvas.items() if len(mva.sort) == 1}
+        foreign_keys = {mva_id: mva for mva_id, mva in pcf.mvas.items() if isinstance(mva, ForeignKey)}
+
+        # the key columns of the foreign keys are read along with the mvas of their sorts
+        key_columns = {sort: [] for sort in self.output}
+        for mva in foreign_keys.values():
+            for sort, column in zip(mva.sort, mva.columns):
+                if sort in key_columns and column not in key_columns[sort]:
+                    key_columns[sort].append(column)
+
+        keys = {}  # (sort, column) -> list of values
+        with pcf.db_info.connection() as cnx:
+            for sort in self.output:
+                mva_ids = [mva_id for mva_id, mva in unary.items() if mva.sort == [sort]]
+                terms = ([pcf.print_sql(sort, "x")] + [unary[mva_id].sql(["x"]) for mva_id in mva_ids]
+                         + ["x.{0}".format(column) for column in key_columns[sort]])
+                query = "SELECT {0} FROM {1} AS x".format(", ".join(terms), sort)
+                cursor = pcf.db_info.dialect.execute(cnx, query)
+                rows = cursor.fetchall()
+                cursor.close()
+
+                values = list(zip(*rows)) if rows else [()] * len(terms)
+                self.labels[sort] = _array(values[0])
+                for mva_id, column in zip(mva_ids, values[1:]):
+                    self.columns[mva_id] = _Column(column)
+                    self.mvas[mva_id] = (unary[mva_id].sort, unary[mva_id].sqldef)
+                for column, column_values in zip(key_columns[sort], values[1+len(mva_ids):]):
+                    keys[(sort, column)] = column_values
+
+        for mva_id, mva in foreign_keys.items():
+            if all(sort in self.output for sort in mva.sort):
+                self.links[mva_id] = _join(keys[(mva.sort[0], mva.columns[0])], keys[(mva.sort[1], mva.columns[1])])
+                self.mvas[mva_id] = (mva.sort, mva.sqldef)
+
+    # whether the snapshot can answer the query for the given window of graph (or, without a graph, the sort counts)
+    def supports(self, pcf, graph=None, window=None, rwindow=None):
+
+        if any(sort not in self.output or self.output[sort] != sqldef for sort, sqldef in pcf.output.items()):
+            return False
+        if graph is None:
+            return True
+
+        if window is not None:
+            rwindow = rwindow or []
+            if rwindow:
+                if len(rwindow) > 1 or window != graph.rnodes[rwindow[0]].endpoints:
+                    return False
+            elif len(window) != 1:
+                return False
+            # as in the sql query, the display columns of a single node are part of the result
+            if len(window) == 1 and not all(self._has_column(pcf, context_id)
+                                            for context_id in graph.nodes[window[0]].display):
+                return False
+
+        if any(node.sort not in self.labels for node in graph.nodes.values()):
+            return False
+
+        # the semi-joins are only exact if the foreign keys between the nodes form a forest
+        roots = {node_id: node_id for node_id in graph.nodes}
+
+        def find(x):
+            while roots[x] != x:
+                x = roots[x]
+            return x
+
+        for rnode in graph.rnodes.values():
+            rcontext = pcf.rcontexts.get(rnode.context_id)
+            if len(rnode.endpoints) == 1:
+                if not self._has_column(pcf, rnode.context_id):
+                    return False
+            elif len(rnode.endpoints) == 2:
+                if not isinstance(rcontext, BooleanFacet) or not self._has_mva(pcf, rcontext.mva_id, self.links):
+                    return False
+                root1, root2 = find(rnode.endpoints[0]), find(rnode.endpoints[1])
+                if root1 == root2:
+                    return False
+                roots[root1] = root2
+            else:
+                return False
+
+        return True
+
+    # header and rows of the result table, with the column names of DBContextFamily._to_sql. as there, the rows are
+    # ordered if a limit is given (though by Python's order, not the collation of the database).
+    def result_table(self, pcf, graph, window, rwindow, limit=None, offset=0):
+
+        masks, keeps = self._masks(pcf, graph)
+
+        if len(window) == 1:
+            node_id = window[0]
+            rows = numpy.flatnonzero(masks[node_id])
+            header = ["node:{0}".format(node_id)]
+            columns = [self.labels[graph.nodes[node_id].sort][rows]]
+            for rnode_id in rwindow:
+                header.append("rnode:{0}".format(rnode_id))
+                columns.append(self.columns[pcf.rcontexts[graph.rnodes[rnode_id].context_id].mva_id].values[rows])
+            for context_id in graph.nodes[node_id].display:
+                header.append("display:{0}:{1}:{2}".format(len(node_id), node_id, context_id))
+                columns.append(self.columns[pcf.rcontexts[context_id].mva_id].values[rows])
+
+        else:
+            rnode_id = rwindow[0]
+            rnode = graph.rnodes[rnode_id]
+            rows1, rows2 = self.links[pcf.rcontexts[rnode.context_id].mva_id]
+            keep = keeps[rnode_id]
+            header = ["node:{0}".format(x) for x in window] + ["rnode:{0}".format(rnode_id)]
+            columns = [self.labels[graph.nodes[window[0]].sort][rows1[keep]],
+                       self.labels[graph.nodes[window[1]].sort][rows2[keep]],
+                       numpy.ones(int(keep.sum()), dtype=int)]
+
+        rows = list(zip(*[column.tolist() for column in columns]))
+        if limit is not None:
+            rows.sort(key=lambda row: [(value is not None, value) for value in row])
+            rows = rows[int(offset):int(offset)+int(limit)]
+        return header, rows
+
+    def result_count(self, pcf, graph, window, rwindow):
+        masks, keeps = self._masks(pcf, graph)
+        if rwindow and len(window) == 2:
+            return int(keeps[rwindow[0]].sum())
+        return int(masks[window[0]].sum())
+
+    # see DBContextFamily.refinement_counts; None if a link is not in the snapshot
+    def refinement_counts(self, pcf, graph, node_id):
+
+        masks, keeps = self._masks(pcf, graph)
+        mask = masks[node_id]
+
+        counts = {}
+        for link in pcf.neighbors(graph.nodes[node_id].sort):
+            rcontext = pcf.rcontexts[link["linkID"]]
+            if isinstance(rcontext, DateIntervalFacet) and self._has_column(pcf, link["linkID"]):
+                # the scale bounds contain all dates, and taking them from the database is not necessary
+                linked = ~numpy.isnat(self.columns[rcontext.mva_id].dates)
+            elif len(rcontext.sort) == 1 and self._has_column(pcf, link["linkID"]):
+                linked = self._pattern(rcontext, rcontext.top())
+            elif isinstance(rcontext, BooleanFacet) and self._has_mva(pcf, rcontext.mva_id, self.links):
+                linked = numpy.zeros(len(mask), dtype=bool)
+                linked[self.links[rcontext.mva_id][link["roleID"]-1]] = True
+            else:
+                return None
+            counts["{0}#{1}".format(link["roleID"], link["linkID"])] = int((mask & linked).sum())
+        return counts
+
+    # see DBContextFamily.value_frequencies
+    def value_frequencies(self, pcf, graph, rnode_id, prefix_length=None, limit=None):
+
+        masks, keeps = self._masks(pcf, graph)
+        rnode = graph.rnodes[rnode_id]
+        column = self.columns[pcf.rcontexts[rnode.context_id].mva_id]
+
+        codes = column.codes[masks[rnode.endpoints[0]]]
+        counts = numpy.bincount(codes[codes >= 0], minlength=len(column.uniques))
+        frequencies = {}
+        for value, count in zip(column.uniques, counts.tolist()):
+            if count:
+                if prefix_length is not None:
+                    value = str(value)[:int(prefix_length)]
+                frequencies[value] = frequencies.get(value, 0) + count
+        nulls = int((codes < 0).sum())
+        if nulls:
+            frequencies[None] = nulls
+
+        frequencies = sorted(frequencies.items(), key=lambda x: (-x[1], x[0] is not None, x[0]))
+        return frequencies[:limit] if limit is not None else frequencies
+
+    # see DBContextFamily.value_histogram
+    def value_histogram(self, pcf, graph, rnode_id):
+
+        masks, keeps = self._masks(pcf, graph)
+        rnode = graph.rnodes[rnode_id]
+        column = self.columns[pcf.rcontexts[rnode.context_id].mva_id]
+
+        dates = column.dates[masks[rnode.endpoints[0]]]
+        dates = dates[~numpy.isnat(dates)]
+        years, counts = numpy.unique(dates.astype("datetime64[Y]").astype(int) + 1970, return_counts=True)
+        return list(zip(years.tolist(), counts.tolist()))
+
+    def sort_counts(self, sorts):
+        return {sort: len(self.labels[sort]) for sort in sorts}
+
+    # the objects of each node which occur in the result of the graph, and for each binary rnode, which of its pairs
+    # do. the unary rnodes filter their nodes, and then each foreign key removes the objects on either side that
+    # have no partner on the other, until nothing changes.
+    def _masks(self, pcf, graph):
+
+        masks = {node_id: numpy.ones(len(self.labels[node.sort]), dtype=bool) for node_id, node in graph.nodes.items()}
+        links = []
+        for rnode_id, rnode in graph.rnodes.items():
+            rcontext = pcf.rcontexts[rnode.context_id]
+            if len(rnode.endpoints) == 1:
+                masks[rnode.endpoints[0]] &= self._pattern(rcontext, rnode.label)
+            else:
+                links.append((rnode_id, rnode.endpoints, self.links[rcontext.mva_id]))
+
+        keeps = {}
+        changed = True
+        while changed:
+            changed = False
+            for rnode_id, endpoints, pairs in links:
+                keep = masks[endpoints[0]][pairs[0]] & masks[endpoints[1]][pairs[1]]
+                keeps[rnode_id] = keep
+                for node_id, rows in zip(endpoints, pairs):
+                    linked = numpy.zeros(len(masks[node_id]), dtype=bool)
+                    linked[rows[keep]] = True
+                    if (masks[node_id] & ~linked).any():
+                        masks[node_id] &= linked
+                        changed = True
+
+        # as in the sql query, the result is empty if a component of the graph is
+        if not all(mask.any() for mask in masks.values()):
+            masks = {node_id: numpy.zeros_like(mask) for node_id, mask in masks.items()}
+            keeps = {rnode_id: numpy.zeros_like(keep) for rnode_id, keep in keeps.items()}
+        return masks, keeps
+
+    # the objects whose value of the unary context's mva matches the label (cf. the pattern_sql of the facets)
+    def _pattern(self, rcontext, label):
+
+        column = self.columns[rcontext.mva_id]
+
+        if isinstance(rcontext, PrefixFacet):
+            if not label:
+                return column.codes >= 0
+            # LIKE is case insensitive in the default collations of MySQL and SQLite
+            prefix = label.lower()
+            matches = [str(value).lower().startswith(prefix) for value in column.uniques]
+
+        elif isinstance(rcontext, DateIntervalFacet):
+            label_min, label_max = json.loads(label)
+            lower = numpy.datetime64("{0:04d}-01-01".format(int(label_min)))
+            upper = numpy.datetime64("{0:04d}-12-31".format(int(label_max)))
+            return (column.dates >= lower) & (column.dates <= upper)
+
+        else:  # BooleanFacet
+            matches = [value == 1 for value in column.uniques]
+
+        # the code of NULL is -1, i.e. the last entry, which never matches
+        return numpy.array(matches + [False], dtype=bool)[column.codes]
+
+    def _has_mva(self, pcf, mva_id, kind):
+        mva = pcf.mvas.get(mva_id)
+        return mva_id in kind and mva is not None and self.mvas[mva_id] == (mva.sort, mva.sqldef)
+
+    def _has_column(self, pcf, context_id):
+        rcontext = pcf.rcontexts.get(context_id)
+        if rcontext is None or not self._has_mva(pcf, rcontext.mva_id, self.columns):
+            return False
+        if isinstance(rcontext, DateIntervalFacet):
+            return self.columns[rcontext.mva_id].dates is not None
+        return isinstance(rcontext, (BooleanFacet, PrefixFacet))
+
+
+# the values of an mva, as an object array, and integer coded. columns of dates (or datetimes) are also kept as
+# datetime64 array, for the date intervals.
+class _Column(object):
+
+    def __init__(self, values):
+
+        self.values = _array(values)
+
+        index = {}
+        codes = [-1 if value is None else index.setdefault(value, len(index)) for value in values]
+        self.codes = numpy.array(codes, dtype=numpy.int64)
+        self.uniques = list(index)
+
+        self.dates = None
+        if self.uniques and all(isinstance(value, datetime.date) for value in self.uniques):
+            self.dates = numpy.array(["NaT" if value is None else value for value in values], dtype="datetime64[us]")
+
+
+def _array(values):
+    array = numpy.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+# the (row, row) pairs of two key columns with equal values
+def _join(keys1, keys2):
+
+    index = {}
+    for j, key in enumerate(keys2):
+        if key is not None:
+            index.setdefault(key, []).append(j)
+
+    rows1 = []
+    rows2 = []
+    for i, key in enumerate(keys1):
+        for j in index.get(key, ()) if key is not None else ():
+            rows1.append(i)
+            rows2.append(j)
+    return numpy.array(rows1, dtype=numpy.int64), numpy.array(rows2, dtype=numpy.int64)
+
+
+_lock = threading.Lock()
+
+
+# takes a snapshot of the database of pcf, which replaces the previous one (if any) once it is complete. the
+# results which were cached for the database are dropped, as they may be older than the snapshot.
+def refresh(pcf):
+
+    if numpy is None:
+        raise RuntimeError("Snapshots require the numpy package")
+    snapshot = Snapshot(pcf)
+    with _lock:
+        snapshots[pcf.db_info.key()] = snapshot
+    invalidate_binding(pcf.db_info.key())
+    return snapshot
+
+
+# from then on, the queries for the database of pcf go to the database again
+def drop(pcf):
+    with _lock:
+        snapshots.pop(pcf.db_info.key(), None)
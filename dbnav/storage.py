@@ -1,6 +1,15 @@
+import json
 import os
+import threading
+from contextlib import contextmanager
+from dbnav.cache import invalidate_binding
 from dbnav.serialization import dump, load
 
+try:
+    import fcntl
+except ImportError:  # e.g. on Windows, where access to the journals is not locked
+    fcntl = None
+
 
 class Storage(object):
 
@@ -11,6 +20,15 @@ class Storage(object):
         "bool": ["BooleanFacet"],
     }
 
+    # edits of a binding are not written to its snapshot (<name>.json) directly, but appended to its journal
+    # (<name>.journal, one JSON encoded operation per line, see DBContextFamily.apply). once the journal has grown
+    # beyond compact_size bytes, it is merged into the snapshot.
+    compact_size = 64 * 1024
+
+    # bindings by snapshot file name, as (snapshot (mtime, size), replayed journal length, binding) triples
+    _bindings = {}
+    _bindings_lock = threading.Lock()
+
     @staticmethod
     def ls():
         basedir = os.path.dirname(os.path.realpath(__file__))
@@ -21,15 +39,112 @@ class Storage(object):
                 bindings.append(name)
         return {"bindings": bindings}
 
+    # the snapshot is only parsed again if the file has changed since it was last read, and of the journal only the
+    # operations which have been appended since then are replayed. callers get a copy of the cached binding (see
+    # DBContextFamily.copy), so changing it doesn't affect the cache or other callers.
     @staticmethod
     def read(pcf):
-        basedir = os.path.dirname(os.path.realpath(__file__))
-        with open(os.path.join(basedir, "resources", "bindings", "{0}.json".format(pcf)), 'r') as infile:
-            pcf = load(infile)
-        return pcf
+        fname = Storage._path(pcf)
+
+        with Storage._journal(fname, "rb") as journal:
+            stat = os.stat(fname)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            end = journal.seek(0, os.SEEK_END) if journal is not None else 0
 
+            with Storage._bindings_lock:
+                cached = Storage._bindings.get(fname)
+
+            if cached is not None and cached[0] == signature and cached[1] <= end:
+                _, offset, pcf = cached
+            else:
+                with open(fname, 'r') as infile:
+                    pcf = load(infile)
+                offset = None
+
+            if offset is None or offset < end:
+                pcf = pcf.copy()
+                offset = Storage._replay(pcf, journal, offset or 0)
+                with Storage._bindings_lock:
+                    Storage._bindings[fname] = (signature, offset, pcf)
+
+        return pcf.copy()
+
+    # replaces the binding, including all edits in its journal
     @staticmethod
     def write(pcf, fname):
+        fname = Storage._path(fname)
+        with Storage._journal(fname, "a+b", exclusive=True) as journal:
+            Storage._write_snapshot(pcf, fname)
+            journal.truncate(0)
+        invalidate_binding(pcf.db_info.key())
+
+    # records an edit of the binding, which has to be applied to the result of read() by the caller itself
+    @staticmethod
+    def append(pcf, op, args):
+        fname = Storage._path(pcf)
+        line = json.dumps({"op": op, "args": args}) + "\n"
+        with Storage._journal(fname, "a+b", exclusive=True) as journal:
+            journal.write(line.encode("utf-8"))
+            journal.flush()
+            if journal.tell() > Storage.compact_size:
+                Storage._compact(fname, journal)
+
+    # must be called with the journal locked exclusively
+    @staticmethod
+    def _compact(fname, journal):
+        with open(fname, 'r') as infile:
+            pcf = load(infile)
+        Storage._replay(pcf, journal, 0)
+        Storage._write_snapshot(pcf, fname)
+        journal.truncate(0)
+
+    # applies the complete lines of the journal from offset on to pcf, and returns the offset after the last of them
+    @staticmethod
+    def _replay(pcf, journal, offset):
+        if journal is None:
+            return offset
+        journal.seek(offset)
+        for line in journal:
+            if not line.endswith(b"\n"):  # the last operation is still being written
+                break
+            entry = json.loads(line.decode("utf-8"))
+            try:
+                pcf.apply(entry["op"], entry["args"])
+            except KeyError:
+                # the operation refers to an mva that a concurrent edit has deleted before it was recorded
+                pass
+            offset += len(line)
+        return offset
+
+    @staticmethod
+    def _write_snapshot(pcf, fname):
+        # write to a temporary file first, so that the snapshot is never seen partially written
+        tmpname = "{0}.{1}.tmp".format(fname, threading.get_ident())
+        with open(tmpname, 'w') as fp:
+            dump(pcf, fp)
+        os.replace(tmpname, fname)
+        # the snapshot's mtime may not have changed if it was read shortly before, so the cache entry is dropped
+        with Storage._bindings_lock:
+            Storage._bindings.pop(fname, None)
+
+    # opens the journal of a binding, locked shared or exclusive for the duration of the with-block. if mode is
+    # read-only and the binding has never been edited, None is given instead.
+    @staticmethod
+    @contextmanager
+    def _journal(fname, mode, exclusive=False):
+        try:
+            journal = open(os.path.splitext(fname)[0] + ".journal", mode)
+        except FileNotFoundError:
+            if "r" in mode and "+" not in mode:
+                yield None
+                return
+            raise
+        with journal:
+            if fcntl is not None:
+                fcntl.flock(journal, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield journal
+
+    @staticmethod
+    def _path(name):
         basedir = os.path.dirname(os.path.realpath(__file__))
-        with open(os.path.join(basedir, "resources", "bindings", "{0}.json".format(fname)), 'w') as fp:
-            dump(pcf,fp)
+        return os.path.join(basedir, "resources", "bindings", "{0}.json".format(name))
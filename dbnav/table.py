@@ -7,6 +7,37 @@ class Table(object):
         self.header = header
         self.rows = rows
 
+    def count(self):
+        return len(self.rows)
+
+
+# a table which is only fetched when its header or rows are accessed. count() doesn't fetch it, unless it has been
+# fetched already.
+class LazyTable(object):
+
+    def __init__(self, fetch, count):
+        self._fetch = fetch
+        self._count = count
+        self._table = None
+
+    @property
+    def header(self):
+        return self._fetched().header
+
+    @property
+    def rows(self):
+        return self._fetched().rows
+
+    def count(self):
+        if self._table is not None:
+            return self._table.count()
+        return self._count()
+
+    def _fetched(self):
+        if self._table is None:
+            self._table = self._fetch()
+        return self._table
+
 
 class DBTable(object):
 
@@ -0,0 +1,275 @@
+import importlib.machinery
+import importlib.util
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import timeit
+import urllib.request
+import wsgiref.simple_server
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIRequestHandler
+from dbnav import faceted_pcf, serialization, snapshot
+from dbnav.cache import result_cache
+from dbnav.dbcf import DBContextFamily
+from dbnav.dialects import dialects, load_dump
+from dbnav.faceted_pcf import FormalContext
+from dbnav.graph import Graph
+from dbnav.server import make_server
+
+
+def bench_serialization(number=200):
+
+    basedir = os.path.dirname(os.path.realpath(__file__))
+    encodings = [
+        ("json", serialization.dumps, serialization.loads),
+        ("json (compact)", lambda obj: serialization.dumps(obj, compact=True), serialization.loads),
+    ]
+    if serialization.msgpack is not None:
+        encodings.append(("msgpack", serialization.packb, serialization.unpackb))
+
+    print("Serialization throughput ({0} round trips)".format(number))
+    for name in ["Literature", "Northwind"]:
+        fname = os.path.join(basedir, os.pardir, "resources", "bindings", "{0}.json".format(name))
+        with open(fname) as fp:
+            pcf = serialization.load(fp)
+
+        for encoding, encode, decode in encodings:
+            data = encode(pcf)
+            t_encode = timeit.timeit(lambda: encode(pcf), number=number)
+            t_decode = timeit.timeit(lambda: decode(data), number=number)
+            print("{0:<12} {1:<16} {2:>8} bytes  encode {3:>8.1f}/s  decode {4:>8.1f}/s".format(
+                name, encoding, len(data), number / t_encode, number / t_decode))
+
+
+# Northwind, loaded into an SQLite database in tmpdir, and a graph of the order details (x1) of orders (x2) of
+# customers from Germany (r3)
+def _northwind(tmpdir):
+
+    basedir = os.path.dirname(os.path.realpath(__file__))
+    dump = os.path.join(basedir, os.pardir, "resources", "sqldumps", "Northwind.sql")
+    fname = os.path.join(tmpdir, "Northwind.sqlite")
+    load_dump(dump, fname)
+    pcf = DBContextFamily("", "", "", fname, "sqlite")
+    pcf.load_contents()
+
+    # the dump has no foreign key constraints, so the relations are added as in the Northwind binding
+    has_customer = pcf.add_foreign_key("has_customer", "Orders", "CustomerID", "Customers", "CustomerID")
+    has_order = pcf.add_foreign_key("has_order", "OrderDetails", "OrderID", "Orders", "OrderID")
+    country = next(mva_id for mva_id, mva in pcf.mvas.items() if mva.sort == ["Customers"] and mva.name == "Country")
+    for mva_id in [has_customer, has_order]:
+        pcf.scale_mva(mva_id, "BooleanFacet")
+    pcf.scale_mva(country, "PrefixFacet")
+
+    graph = Graph(pcf)
+    x1 = graph.add_node("OrderDetails")
+    r1 = graph.add_rnode(has_order, [x1, None])
+    x2 = graph.rnodes[r1].endpoints[1]
+    r2 = graph.add_rnode(has_customer, [x2, None])
+    x3 = graph.rnodes[r2].endpoints[1]
+    r3 = graph.add_rnode(country, [x3])
+    graph.rnodes[r3].label = "Germany"
+    return pcf, graph, x1, x2, r3
+
+
+# navigation queries on Northwind, loaded into SQLite, and (if numpy is installed) answered from a snapshot. the
+# result cache is cleared before each query, so that every run reaches the database.
+def bench_queries(number=50):
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pcf, graph, x1, x2, r3 = _northwind(tmpdir)
+
+        queries = [
+            ("extent (first page)", lambda: graph.extent(x1, limit=100)),
+            ("count", lambda: graph.count(x1)),
+            ("refinement counts", lambda: pcf.refinement_counts(graph, x2)),
+            ("value frequencies", lambda: graph.rstats(r3)),
+        ]
+
+        def run(query):
+            result_cache.clear()
+            query()
+
+        print("Navigation queries on Northwind (SQLite, {0} runs)".format(number))
+        for name, query in queries:
+            print("{0:<24} {1:>8.2f} ms".format(name, 1000 * timeit.timeit(lambda: run(query), number=number) / number))
+
+        if snapshot.numpy is not None:
+            print("Navigation queries on Northwind (snapshot, {0} runs)".format(number))
+            snapshot.refresh(pcf)
+            for name, query in queries:
+                print("{0:<24} {1:>8.2f} ms".format(name,
+                                                    1000 * timeit.timeit(lambda: run(query), number=number) / number))
+            snapshot.drop(pcf)
+
+
+# extents and intents of a random formal context, compared with a scan of the (object, attribute) pairs as they were
+# stored before FormalContext had bitsets
+def bench_formal_context(objects=10**5, attributes=20, density=0.3, number=20):
+
+    rng = random.Random(0)
+    atts = ["m{0}".format(i) for i in range(attributes)]
+    rows = [[m for m in atts if rng.random() < density] for i in range(objects)]
+    start = time.perf_counter()
+    context = FormalContext(atts)
+    for i, row in enumerate(rows):
+        context.add_object(i, row)
+    context.intent([])  # the bitsets are built when they are first read
+    t_build = time.perf_counter() - start
+    incidence = context.incidence
+    obj_ids = rng.sample(list(context.objects), 1000)
+    # objects which share two attributes, so that a scan can't stop at the first object missing an attribute
+    shared_ids = [obj_id for obj_id, obj in context.extent(atts[:2])][:1000]
+
+    def scan_extent(query):
+        return [(g, obj) for g, obj in context.objects.items() if all((g, m) in incidence for m in query)]
+
+    def scan_intent(query):
+        return [m for m in context.attributes if all((g, m) in incidence for g in query)]
+
+    cases = [
+        ("extent of 1 attribute", lambda: context.extent(atts[:1]), lambda: scan_extent(atts[:1])),
+        ("extent of 3 attributes", lambda: context.extent(atts[:3]), lambda: scan_extent(atts[:3])),
+        ("intent of 1000 objects", lambda: context.intent(obj_ids), lambda: scan_intent(obj_ids)),
+        ("intent (2 shared atts)", lambda: sorted(context.intent(shared_ids)), lambda: sorted(scan_intent(shared_ids))),
+    ]
+
+    print("Formal context with {0} objects and {1} attributes ({2} runs)".format(objects, attributes, number))
+    print("{0:<24} {1:>8.2f} ms".format("build", 1000 * t_build))
+    for name, bitsets, scan in cases:
+        assert bitsets() == scan()
+        t_bitsets = timeit.timeit(bitsets, number=number) / number
+        t_scan = timeit.timeit(scan, number=number) / number
+        print("{0:<24} bitsets {1:>8.2f} ms  scan {2:>8.2f} ms".format(name, 1000 * t_bitsets, 1000 * t_scan))
+
+    if faceted_pcf.numpy is not None:
+        t_matrix = timeit.timeit(context.matrix, number=number) / number
+        print("{0:<24} {1:>8.2f} ms".format("incidence matrix", 1000 * t_matrix))
+
+
+class _QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+# the module of app.wsgi
+def _load_app():
+    basedir = os.path.dirname(os.path.realpath(__file__))
+    loader = importlib.machinery.SourceFileLoader("dbnav_app", os.path.join(basedir, os.pardir, "app.wsgi"))
+    module = importlib.util.module_from_spec(importlib.util.spec_from_loader(loader.name, loader))
+    loader.exec_module(module)
+    return module
+
+
+# compares the single-threaded server with the thread pool server, for clients sending requests concurrently
+def bench_server(requests=400, clients=16, workers=(1, 8)):
+
+    application = _load_app().application
+    ajax = json.dumps({"cmd": "insert_index_view", "args": {}}).encode("utf-8")
+
+    def get(url):
+        request = urllib.request.Request(url, headers={"Accept-Encoding": "gzip"})
+        with urllib.request.urlopen(request) as response:
+            response.read()
+
+    def post(url):
+        with urllib.request.urlopen(url, data=ajax) as response:
+            response.read()
+
+    print("Server throughput ({0} requests from {1} clients)".format(requests, clients))
+    for n in workers:
+        server = make_server("127.0.0.1", 0, application, workers=n, handler_class=_QuietHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        base = "http://127.0.0.1:{0}".format(server.server_port)
+
+        for name, send, url in [("GET /", get, base + "/"),
+                                ("GET /scripts/jquery-ui.js", get, base + "/scripts/jquery-ui.js"),
+                                ("POST /ajax/", post, base + "/ajax/")]:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=clients) as executor:
+                list(executor.map(lambda i: send(url), range(requests)))
+            elapsed = time.perf_counter() - start
+            print("workers={0:<3} {1:<26} {2:>8.1f} requests/s".format(n, name, requests / elapsed))
+
+        server.shutdown()
+        server.server_close()
+
+
+# clients navigating at the same time while every query takes delay seconds longer, as a slow query of a large
+# database does: wsgiref's server handles one request after the other, so each client waits for the queries of all
+# others, while the thread pool server runs them side by side. each client has its own session (the requests of a
+# session are serialized by app.wsgi in any case) and pages through the Northwind customers; the query itself is
+# cheap, so that the delay stands for the time spent in the database server. the result cache is switched off, so
+# that every request reaches the database.
+def bench_slow_queries(requests=24, clients=4, delay=0.2, workers=8):
+
+    app = _load_app()
+    dialect = dialects["sqlite"]
+
+    def slow_execute(cnx, query, params=None):
+        time.sleep(delay)
+        return type(dialect).execute(dialect, cnx, query, params)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pcf = _northwind(tmpdir)[0]
+        sessions = []
+        for i in range(clients):
+            graph = Graph(pcf)
+            x1 = graph.add_node("Customers")
+            session = app.sessions.new_id()
+            app.sessions.put(session, {"main": "navigate", "pcf_name": "Northwind", "graph": graph,
+                                       "current_node": x1, "current_link": {"linkID": None, "roleID": None},
+                                       "table_page": 0})
+            sessions.append(session)
+
+        def post(url, i):
+            ajax = {"cmd": "set_table_page", "args": {"page": i // clients}, "session": sessions[i % clients]}
+            with urllib.request.urlopen(url, data=json.dumps(ajax).encode("utf-8")) as response:
+                response.read()
+
+        print("Navigation with queries delayed by {0:.0f} ms ({1} requests from {2} clients)".format(
+            1000 * delay, requests, clients))
+        max_entries = result_cache.max_entries
+        result_cache.max_entries = 0
+        dialect.execute = slow_execute
+        try:
+            for name, server in [("wsgiref", wsgiref.simple_server.make_server("127.0.0.1", 0, app.application,
+                                                                               handler_class=_QuietHandler)),
+                                 ("workers={0}".format(workers), make_server("127.0.0.1", 0, app.application,
+                                                                             workers=workers,
+                                                                             handler_class=_QuietHandler))]:
+                thread = threading.Thread(target=server.serve_forever, daemon=True)
+                thread.start()
+                url = "http://127.0.0.1:{0}/ajax/".format(server.server_port)
+
+                latencies = []
+
+                def timed_post(i):
+                    start = time.perf_counter()
+                    post(url, i)
+                    latencies.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=clients) as executor:
+                    list(executor.map(timed_post, range(requests)))
+                elapsed = time.perf_counter() - start
+                print("{0:<12} {1:>8.1f} requests/s  mean latency {2:>8.0f} ms".format(
+                    name, requests / elapsed, 1000 * sum(latencies) / len(latencies)))
+
+                server.shutdown()
+                server.server_close()
+        finally:
+            del dialect.execute
+            result_cache.max_entries = max_entries
+
+
+if __name__ == "__main__":
+    bench_serialization()
+    bench_formal_context()
+    bench_queries()
+    bench_server()
+    bench_slow_queries()
@@ -1,7 +1,13 @@
 import os
+import copy
 import difflib
-from dbnav import serialization
+import sqlite3
+import tempfile
+from dbnav import serialization, snapshot
+from dbnav.dbcf import DBContextFamily, _query
+from dbnav.dialects import load_dump
 from dbnav.graph import Graph, Point
+from dbnav.storage import Storage
 from dbnav.faceted_pcf import FacetedPowerContextFamily
 
 
@@ -117,6 +123,269 @@ def test2():
         for chunk in iter_diff:
             print(chunk, end="")
 
+    json3 = serialization.dumps(serialization.loads(serialization.dumps(pcf, compact=True)))
+
+    print("Test2.2: PowerContextfamily compact JSON decode/encode")
+    if json1 == json3:
+        print("*** Success ***")
+    else:
+        print("*** Failure ***")
+        iter_diff = difflib.unified_diff(json1.splitlines(True), json3.splitlines(True), lineterm="\n")
+        for chunk in iter_diff:
+            print(chunk, end="")
+
+    print("Test2.3: FormalContext extent/intent")
+    context = serialization.loads(json1).object_context
+    authors = [a1, a2, a3, a4, a5, a6, a7]
+    if ([obj_id for obj_id, obj in context.extent(["Author"])] == authors and context.extent(["Author", "Book"]) == []
+            and len(context.extent([])) == 17 and context.intent([b1, b2]) == ["Book"]
+            and sorted(context.intent([])) == ["Author", "Book"] and context.has(a1, "Author")
+            and not context.has(b1, "Author")):
+        print("*** Success ***")
+    else:
+        print("*** Failure ***")
+
+
+# the query of a window as DBContextFamily._to_sql used to compile it, which serves as the reference for the compiled
+# queries: all nodes of the graph are listed in the from clause, separated by commas (i.e. their cross join, even of
+# nodes that aren't connected to the window), and the conditions of all rnodes are in the where clause
+def _cross_join_sql(pcf, graph, window, rwindow):
+
+    select = [pcf.print_sql(graph.nodes[x].sort, x) for x in window]
+    select += [pcf.rcontexts[graph.rnodes[r].context_id].mva_sql(graph.rnodes[r].endpoints) for r in rwindow]
+    if len(window) == 1:
+        select += [pcf.rcontexts[c].mva_sql([window[0]]) for c in graph.nodes[window[0]].display]
+
+    from_ = ["{0} AS {1}".format(node.sort, node_id) for node_id, node in graph.nodes.items()]
+    where = []
+    params = []
+    for rnode in graph.rnodes.values():
+        condition, condition_params = pcf.rcontexts[rnode.context_id].pattern_sql(rnode.label, rnode.endpoints)
+        where.append(condition)
+        params += condition_params
+
+    query = ("SELECT DISTINCT " + ", ".join(select) + " FROM " + ", ".join(from_)
+             + (" WHERE " if where else "") + " AND ".join(where))
+    return query, params
+
+
+def test3():
+
+    basedir = os.path.dirname(os.path.realpath(__file__))
+    dump = os.path.join(basedir, os.pardir, "resources", "sqldumps", "Literature.sql")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fname = os.path.join(tmpdir, "Literature.sqlite")
+        load_dump(dump, fname)
+
+        pcf = DBContextFamily("", "", "", fname, "sqlite")
+        pcf.load_contents()
+
+        print("Test3.1: SQLite schema")
+        mvas = sorted((mva.name, mva.sort, mva.datatype) for mva in pcf.mvas.values())
+        expected = [("author", ["Book"], "int"), ("date_of_birth", ["Author"], "date"),
+                    ("first_name", ["Author"], "varchar"), ("id", ["Author"], "int"),
+                    ("last_name", ["Author"], "varchar"), ("nationality", ["Author"], "varchar"),
+                    ("publication_date", ["Book"], "date"), ("title", ["Book"], "varchar"),
+                    ("wrote", ["Book", "Author"], "bool")]
+        if mvas == expected and pcf.output == {"Author": "{0}.id", "Book": "{0}.title"}:
+            print("*** Success ***")
+        else:
+            print("*** Failure ***")
+            print(mvas)
+            print(pcf.output)
+
+        ids = {mva.name: mva_id for mva_id, mva in pcf.mvas.items()}
+        pcf.scale_mva(ids["nationality"], "PrefixFacet")
+        pcf.scale_mva(ids["publication_date"], "DateIntervalFacet")
+        pcf.scale_mva(ids["wrote"], "BooleanFacet")
+        pcf.set_printsql("Author", pcf.db_info.dialect.concat(["{0}.first_name", "' '", "{0}.last_name"]))
+
+        # the British authors of books published since 2000
+        graph = Graph(pcf)
+        x1 = graph.add_node("Author")
+        r1 = graph.add_rnode(ids["wrote"], [None, x1])
+        x2 = graph.rnodes[r1].endpoints[0]
+        r2 = graph.add_rnode(ids["nationality"], [x1])
+        graph.rnodes[r2].label = "B"
+        r3 = graph.add_rnode(ids["publication_date"], [x2])
+        graph.rnodes[r3].label = "[2000, 2020]"
+
+        print("Test3.2: SQLite navigation")
+        rows = sorted(graph.extent(x1).rows)
+        stats = graph.rstats(r3)
+        # the histogram has a bin for every year of the scale, including the years without books
+        histogram = [(year, count) for year, count in stats["histogram"] if count]
+        years = [year for year, count in stats["histogram"]]
+        if (rows == [("J. K. Rowling",), ("Neil Gaiman",)] and graph.count(x2) == 3
+                and histogram == [(2007, 1), (2012, 1), (2015, 1)]
+                and years == list(range(stats["scale_min"], stats["scale_max"] + 1))):
+            print("*** Success ***")
+        else:
+            print("*** Failure ***")
+            print(rows, graph.count(x2), stats)
+
+        print("Test3.3: SQLite binding JSON decode/encode")
+        json1 = serialization.dumps(pcf)
+        pcf2 = serialization.loads(json1)
+        if json1 == serialization.dumps(pcf2) and pcf2.db_info.backend == "sqlite":
+            print("*** Success ***")
+        else:
+            print("*** Failure ***")
+
+        print("Test3.4: snapshot navigation")
+        if snapshot.numpy is None:
+            print("*** Skipped (numpy is not installed) ***")
+        else:
+            # the results of a node with a display column, and of a unary rnode on it
+            shown = copy.deepcopy(graph)
+            shown.nodes[x1].display.add(ids["nationality"])
+            tables = [(graph.extent(x).rows, graph.extent(x, 1, 1).rows, graph.count(x)) for x in [x1, x2]]
+            tables += [(shown.extent(x1).rows, sorted(shown.rextent(r2).rows), shown.rcount(r2))]
+            stats = [graph.rstats(r) for r in [r2, r3]] + [pcf.refinement_counts(graph, x) for x in [x1, x2]]
+            snapshot.refresh(pcf)
+            supported = pcf._snapshot(graph) is not None and pcf._snapshot(shown, [x1], [r2]) is not None
+            tables2 = [(graph.extent(x).rows, graph.extent(x, 1, 1).rows, graph.count(x)) for x in [x1, x2]]
+            tables2 += [(shown.extent(x1).rows, sorted(shown.rextent(r2).rows), shown.rcount(r2))]
+            stats2 = [graph.rstats(r) for r in [r2, r3]] + [pcf.refinement_counts(graph, x) for x in [x1, x2]]
+            snapshot.drop(pcf)
+            if supported and [(sorted(rows), page, count) for rows, page, count in tables] == \
+                    [(sorted(rows), page, count) for rows, page, count in tables2] and stats == stats2:
+                print("*** Success ***")
+            else:
+                print("*** Failure ***")
+                print(tables, tables2)
+                print(stats, stats2)
+
+        print("Test3.5: compiled queries vs. cross join")
+        windows = [(graph, [x1], []), (graph, [x2], []), (graph, graph.rnodes[r1].endpoints, [r1]),
+                   (graph, [x1], [r2]), (graph, [x2], [r3])]
+
+        graph2 = copy.deepcopy(graph)
+        graph2.nodes[x1].display.add(ids["nationality"])
+        windows.append((graph2, [x1], []))
+
+        # a disconnected component, which is empty for the second graph
+        for label in ["[2010, 2020]", "[1000, 1001]"]:
+            graph3 = Graph(pcf)
+            y1 = graph3.add_node("Author")
+            y2 = graph3.add_node("Book")
+            s1 = graph3.add_rnode(ids["publication_date"], [y2])
+            graph3.rnodes[s1].label = label
+            windows += [(graph3, [y1], []), (graph3, [y2], [s1])]
+
+        # co-authors (a path author - book - author)
+        graph4 = copy.deepcopy(graph)
+        s1 = graph4.add_rnode(ids["wrote"], [x2, None])
+        y1 = graph4.rnodes[s1].endpoints[1]
+        windows += [(graph4, [x1], []), (graph4, [y1], []), (graph4, graph4.rnodes[s1].endpoints, [s1])]
+
+        # a self-loop, whose endpoints are merged into a single node
+        same_id = pcf.add_foreign_key("same_id", "Author", "id", "Author", "id")
+        pcf.scale_mva(same_id, "BooleanFacet")
+        graph5 = Graph(pcf)
+        y1 = graph5.add_node("Author")
+        s1 = graph5.add_rnode(same_id, [y1, None])
+        graph5.merge(graph5.rnodes[s1].endpoints[1], y1)
+        windows += [(graph5, [y1], []), (graph5, graph5.rnodes[s1].endpoints, [s1])]
+
+        failures = []
+        for g, window, rwindow in windows:
+            rows = sorted(map(repr, pcf.result_table(g, window, rwindow).rows))
+            count = pcf.result_count(g, window, rwindow)
+            expected = sorted(map(repr, _query(pcf.db_info, *_cross_join_sql(pcf, g, window, rwindow))[1]))
+            if rows != expected or count != len(expected):
+                failures.append((window, rwindow, rows, count, expected))
+        if not failures:
+            print("*** Success ***")
+        else:
+            print("*** Failure ***")
+            for failure in failures:
+                print(failure)
+
+        print("Test3.6: SQLite placeholders and read-only connections")
+        # a derived mva whose sqldef has a %s in a string literal, which isn't a placeholder
+        seconds = pcf.add_mva("seconds", ["Book"], "varchar", "strftime('%s', {0}.publication_date)", None)
+        pcf.scale_mva(seconds, "PrefixFacet")
+        graph6 = Graph(pcf)
+        y1 = graph6.add_node("Book")
+        s1 = graph6.add_rnode(seconds, [y1])
+        graph6.rnodes[s1].label = "1"
+        expected = _query(pcf.db_info, "SELECT COUNT(*) FROM Book WHERE strftime('%s', publication_date) LIKE '1%'")
+        try:
+            DBContextFamily("", "", "", os.path.join(tmpdir, "Mistyped.sqlite"), "sqlite").load_contents()
+            read_only = False
+        except sqlite3.Error:
+            read_only = not os.path.exists(os.path.join(tmpdir, "Mistyped.sqlite"))
+        if graph6.count(y1) == expected[1][0][0] > 0 and read_only:
+            print("*** Success ***")
+        else:
+            print("*** Failure ***")
+            print(graph6.count(y1), expected, read_only)
+
+        # a binding of the Literature database, written to the bindings directory under a name of its own
+        name = "test-{0}".format(os.getpid())
+        base = os.path.splitext(Storage._path(name))[0]
+        compact_size = Storage.compact_size
+        try:
+            Storage.write(pcf, name)
+
+            print("Test3.7: copies of a stored binding")
+            # the bindings returned by Storage.read are copies of a cached one, which share none of its mvas
+            pcf2 = Storage.read(name)
+            pcf2.mvas[ids["title"]].name = "subtitle"
+            pcf2.mvas[ids["title"]].sort.append("Author")
+            pcf2.rcontexts[ids["nationality"]].mva.roles.append("ARG2")
+            pcf3 = Storage.read(name)
+            if serialization.dumps(pcf3) == serialization.dumps(pcf) and pcf3.mvas[ids["title"]].name == "title":
+                print("*** Success ***")
+            else:
+                print("*** Failure ***")
+                print(pcf3.mvas[ids["title"]].to_dict(), pcf3.rcontexts[ids["nationality"]].mva.to_dict())
+
+            print("Test3.8: binding journal")
+            # an edit appended to the journal is replayed on the cached binding, without replaying the ones before it
+            Storage.append(name, "add_mva", ["isbn", ["Book"], "varchar", "{0}.isbn", None])
+            Storage.read(name)
+            Storage.append(name, "add_mva", ["pages", ["Book"], "int", "{0}.pages", None])
+            names = [mva.name for mva in Storage.read(name).mvas.values()]
+            appended = names.count("isbn") == 1 and names.count("pages") == 1
+
+            # an edit of an mva which an earlier edit in the same journal has deleted is skipped
+            deleted = Storage.read(name).add_mva("deleted", ["Book"], "varchar", "{0}.title", None)
+            for op, args in [("add_mva", ["deleted", ["Book"], "varchar", "{0}.title", None]),
+                             ("delete_mva", [deleted]), ("scale_mva", [deleted, "PrefixFacet"]),
+                             ("set_printsql", ["Book", "{0}.isbn"])]:
+                Storage.append(name, op, args)
+            pcf4 = Storage.read(name)
+            skipped = deleted not in pcf4.mvas and deleted not in pcf4.rcontexts and pcf4.output["Book"] == "{0}.isbn"
+
+            # once the journal is longer than compact_size, it is merged into the snapshot and truncated
+            Storage.compact_size = os.path.getsize(base + ".journal") + 100
+            sizes = []
+            for i in range(10):
+                Storage.append(name, "set_printsql", ["Book", "'{0}'".format(i)])
+                sizes.append(os.path.getsize(base + ".journal"))
+            with open(base + ".json") as fp:
+                stored = serialization.load(fp)
+            compacted = sizes.index(0) if 0 in sizes else None
+            compacted_ok = (compacted is not None and all(0 < size <= Storage.compact_size for size in sizes[:compacted])
+                            and sorted(mva.name for mva in stored.mvas.values()) == sorted(names)
+                            and stored.output["Book"] == "'{0}'".format(compacted)
+                            and Storage.read(name).output["Book"] == "'9'")
+
+            if appended and skipped and compacted_ok:
+                print("*** Success ***")
+            else:
+                print("*** Failure ***")
+                print(names, pcf4.mvas.get(deleted), pcf4.output, sizes, stored.output)
+        finally:
+            Storage.compact_size = compact_size
+            for extension in [".json", ".journal"]:
+                if os.path.exists(base + extension):
+                    os.remove(base + extension)
+
 
 if __name__ == "__main__":
     test2()
+    test3()
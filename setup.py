@@ -5,4 +5,8 @@ setup(
     version="1.0",
     description="Database Navigation",
     install_requires=["mysql-connector-python"],
+    extras_require={
+        # in-memory snapshots of the database (see dbnav.snapshot)
+        "snapshot": ["numpy"],
+    },
 )